@@ -0,0 +1,153 @@
+"""Бенчмарк запросов статистики и лимитов до и после миграций (индексы, агрегаты).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_db --rows 2000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import aiosqlite
+
+from db.migrations import run_migrations
+
+MODELS = ["flux", "zimage", "imagen-4", "klein", "klein-large", "gptimage"]
+
+# (название, запрос до миграции, запрос после миграции)
+QUERIES = [
+    (
+        "usage пользователя за день",
+        "SELECT COUNT(*) FROM model_usage WHERE user_id = ? AND model = ? AND used_date = ?",
+        "SELECT COUNT(*) FROM model_usage WHERE user_id = ? AND model = ? AND used_date = ?",
+    ),
+    (
+        "usage всех за день (GROUP BY)",
+        "SELECT user_id, model, COUNT(*) FROM model_usage WHERE used_date = ? GROUP BY user_id, model",
+        "SELECT user_id, model, COUNT(*) FROM model_usage WHERE used_date = ? GROUP BY user_id, model",
+    ),
+    (
+        "генераций сегодня",
+        "SELECT COUNT(*) FROM generations WHERE date(created_at) = ?",
+        "SELECT generations FROM stats_daily WHERE day = ?",
+    ),
+    (
+        "топ сегодня",
+        """SELECT u.user_id, COUNT(g.id) as gen_count FROM users u
+           LEFT JOIN generations g ON u.user_id = g.user_id
+           WHERE date(g.created_at) = ? GROUP BY u.user_id HAVING gen_count > 0
+           ORDER BY gen_count DESC LIMIT 7""",
+        """SELECT s.user_id, s.generations FROM stats_user_daily s
+           LEFT JOIN users u ON u.user_id = s.user_id
+           WHERE s.day = ? ORDER BY s.generations DESC LIMIT 7""",
+    ),
+    (
+        "топ за всё время",
+        """SELECT u.user_id, COUNT(g.id) as gen_count FROM users u
+           LEFT JOIN generations g ON u.user_id = g.user_id
+           GROUP BY u.user_id ORDER BY gen_count DESC LIMIT 7""",
+        """SELECT s.user_id, s.generations FROM stats_user s
+           LEFT JOIN users u ON u.user_id = s.user_id
+           ORDER BY s.generations DESC LIMIT 7""",
+    ),
+    (
+        "популярная модель",
+        "SELECT model, COUNT(*) as c FROM model_usage GROUP BY model ORDER BY c DESC LIMIT 1",
+        "SELECT model, usage FROM stats_model ORDER BY usage DESC LIMIT 1",
+    ),
+    (
+        "среднее на пользователя",
+        """SELECT CAST(COUNT(g.id) AS FLOAT) / NULLIF(COUNT(DISTINCT u.user_id), 0)
+           FROM users u LEFT JOIN generations g ON u.user_id = g.user_id""",
+        "SELECT CAST(SUM(generations) AS FLOAT) / NULLIF(SUM(new_users), 0) FROM stats_daily",
+    ),
+    (
+        "новых пользователей сегодня",
+        "SELECT COUNT(*) FROM users WHERE date(created_at) = ?",
+        "SELECT new_users FROM stats_daily WHERE day = ?",
+    ),
+]
+
+
+def _params(name: str, day: str) -> tuple:
+    if name.startswith("usage пользователя"):
+        return (42, "klein", day)
+    if "?" not in next(q[1] for q in QUERIES if q[0] == name):
+        return ()
+    return (day,)
+
+
+async def _fill(db: aiosqlite.Connection, rows: int, users: int, days: int):
+    rnd = random.Random(1)
+    start = date.today() - timedelta(days=days - 1)
+    await db.executemany(
+        "INSERT INTO users (user_id, username, full_name, created_at) VALUES (?, ?, ?, ?)",
+        (
+            (uid, f"user{uid}", f"User {uid}", f"{start + timedelta(days=rnd.randrange(days))} 12:00:00")
+            for uid in range(1, users + 1)
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO generations (user_id, original_prompt, final_prompt, created_at) VALUES (?, 'cat', 'a cat', ?)",
+        (
+            (rnd.randint(1, users), f"{start + timedelta(days=rnd.randrange(days))} 12:00:00")
+            for _ in range(rows)
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO model_usage (user_id, model, used_date) VALUES (?, ?, ?)",
+        (
+            (rnd.randint(1, users), rnd.choice(MODELS), str(start + timedelta(days=rnd.randrange(days))))
+            for _ in range(rows)
+        ),
+    )
+    await db.commit()
+
+
+async def _measure(db: aiosqlite.Connection, sql: str, params: tuple, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor = await db.execute(sql, params)
+        await cursor.fetchall()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+async def main(rows: int, users: int, days: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = await aiosqlite.connect(os.path.join(tmp, "bench.db"))
+        await db.execute("PRAGMA journal_mode=WAL")
+        await run_migrations(db, target=1)
+
+        started = time.perf_counter()
+        await _fill(db, rows, users, days)
+        print(f"Заполнение: {rows} строк за {time.perf_counter() - started:.1f} с")
+
+        today = str(date.today())
+        before = {}
+        for name, old_sql, _ in QUERIES:
+            before[name] = await _measure(db, old_sql, _params(name, today), repeat)
+
+        started = time.perf_counter()
+        await run_migrations(db)
+        print(f"Миграции: {time.perf_counter() - started:.1f} с\n")
+
+        print(f"{'запрос':<32} {'до, мс':>10} {'после, мс':>10}")
+        for name, _, new_sql in QUERIES:
+            after = await _measure(db, new_sql, _params(name, today), repeat)
+            print(f"{name:<32} {before[name]:>10.2f} {after:>10.2f}")
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.users, args.days, args.repeat))
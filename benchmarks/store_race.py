@@ -0,0 +1,89 @@
+"""Проверка атомарности лимитов SQLiteStore: несколько процессов одновременно занимают слоты.
+
+Запуск из корня репозитория:
+    python -m benchmarks.store_race --processes 4 --attempts 60 --limit 100
+
+Занятых слотов должно быть ровно min(limit, processes * attempts), и столько же — в счётчике;
+иначе скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from db.migrations import run_migrations
+from db.store import SQLiteStore
+
+USER_ID = 1
+MODEL = "klein"
+DAY = "2000-01-01"
+
+
+async def _prepare(path: str):
+    db = await aiosqlite.connect(path)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await run_migrations(db)
+    await db.close()
+
+
+async def _reserve(path: str, attempts: int, limit: int, start: float) -> int:
+    store = SQLiteStore(path)
+    await store.get_usage(USER_ID, DAY)  # соединение открыто до старта гонки
+    await asyncio.sleep(max(0.0, start - time.time()))
+    reserved = 0
+    for _ in range(attempts):
+        reserved += await store.add_usage(USER_ID, MODEL, DAY, limit)
+    await store.close()
+    return reserved
+
+
+def _worker(path: str, attempts: int, limit: int, start: float, results):
+    results.put(asyncio.run(_reserve(path, attempts, limit, start)))
+
+
+async def _counter(path: str) -> int:
+    store = SQLiteStore(path)
+    usage = await store.get_usage(USER_ID, DAY)
+    await store.close()
+    return usage.get(MODEL, 0)
+
+
+def main(processes: int, attempts: int, limit: int) -> bool:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "race.db")
+        asyncio.run(_prepare(path))
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        # Общий момент старта, чтобы процессы успели запуститься и действительно шли параллельно
+        start = time.time() + 2
+        workers = [
+            ctx.Process(target=_worker, args=(path, attempts, limit, start, results))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        reserved = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        counter = asyncio.run(_counter(path))
+
+    expected = min(limit, processes * attempts)
+    print(f"Попыток: {processes} × {attempts}, лимит {limit}, за {elapsed:.2f} с")
+    print(f"Занято слотов: {reserved}, в счётчике: {counter}, ожидалось: {expected}")
+    return reserved == counter == expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--attempts", type=int, default=60)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(0 if main(args.processes, args.attempts, args.limit) else 1)
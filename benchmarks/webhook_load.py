@@ -0,0 +1,78 @@
+"""Нагрузочный стенд webhook: шлёт синтетические апдейты на локально запущенного бота.
+
+Бот запускается в режиме webhook (WEBHOOK_URL, WEBHOOK_SECRET), затем из корня репозитория:
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8080/webhook --secret $WEBHOOK_SECRET \\
+        --updates 1000 --concurrency 50
+
+Апдейты приходят от несуществующих пользователей, поэтому ответы бота в Telegram
+завершатся ошибкой — стенд меряет приём апдейтов и проверку секрета, а не доставку.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+BASE_USER_ID = 900_000_000
+
+
+def make_update(update_id: int, users: int, text: str) -> dict:
+    user_id = BASE_USER_ID + update_id % users
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"},
+            "text": text,
+        },
+    }
+
+
+async def main(url: str, secret: str, updates: int, concurrency: int, users: int, text: str):
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    counter = iter(range(1, updates + 1))
+
+    async def worker(session: aiohttp.ClientSession):
+        for update_id in counter:
+            started = time.perf_counter()
+            async with session.post(
+                url,
+                json=make_update(update_id, users, text),
+                headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+            ) as resp:
+                await resp.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        # Чужой секрет должен отклоняться
+        async with session.post(url, json=make_update(0, users, text),
+                                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+            print(f"Неверный секрет: HTTP {resp.status}")
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Апдейтов: {updates} за {elapsed:.2f} с ({updates / elapsed:.0f}/с), статусы: {statuses}")
+    print(
+        f"Задержка, мс: медиана {statistics.median(latencies) * 1000:.1f}, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}, "
+        f"макс. {latencies[-1] * 1000:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.secret, args.updates, args.concurrency, args.users, args.text))
@@ -1,18 +1,32 @@
 import asyncio
 import logging
+import multiprocessing
+import signal
+import sys
+from multiprocessing.connection import wait
 
 import aiohttp
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from config import settings
 from db.database import init_db, close_db
+from db.fsm_storage import fsm_storage
+from db.store import store
+from db.writer import write_buffer
 from handlers import start, menu, settings as settings_handler, generation, admin
 from middlewares.subscription import SubscriptionMiddleware
+from middlewares.throttling import ThrottlingMiddleware
 from services.gemini import GeminiService
+from services.image_cache import image_cache
+from services.prompt_cache import prompt_cache
+from services.logger import generation_log
 from services.pollinations import PollinationsService
+from services.queue import GenerationQueue
+from services.send_scheduler import send_scheduler
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,26 +34,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+WEBHOOK_GRACE_PERIOD = 10  # сколько секунд при остановке ждать уже принятые апдейты
 
-async def main():
+
+async def _health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, worker_id: int = 0):
+    """Принимает апдейты через webhook до SIGINT/SIGTERM."""
+    app = web.Application()
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=settings.webhook_secret)
+    handler.register(app, path=settings.webhook_path)
+    app.router.add_get("/health", _health)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    # Несколько процессов слушают один порт — соединения между ними распределяет ядро
+    site = web.TCPSite(
+        runner, settings.webhook_host, settings.webhook_port,
+        reuse_port=True if settings.workers > 1 else None,
+    )
+    await site.start()
+    if worker_id == 0:
+        await bot.set_webhook(
+            f"{settings.webhook_url}{settings.webhook_path}",
+            secret_token=settings.webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logger.info(
+        "Webhook слушает %s:%s%s (процесс %d)",
+        settings.webhook_host, settings.webhook_port, settings.webhook_path, worker_id,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows: остановка через KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Webhook останавливается...")
+        # Сначала перестаём принимать апдейты, потом даём доработать принятым
+        await site.stop()
+        pending = getattr(handler, "_background_feed_update_tasks", set())
+        if pending:
+            await asyncio.wait(pending, timeout=WEBHOOK_GRACE_PERIOD)
+        await runner.cleanup()
+
+
+async def main(worker_id: int = 0):
     bot = Bot(
         token=settings.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=fsm_storage)
 
     # Инит БД
     await init_db()
+    write_buffer.start()
+    fsm_storage.start()
+    if image_cache:
+        await image_cache.load()
+    if prompt_cache:
+        await prompt_cache.load()
 
     # Сервисы
-    session = aiohttp.ClientSession(auto_decompress=False)
-    gemini_service = GeminiService(session)
+    # Одна сессия на весь бот: keep-alive пул соединений к API генерации и сервису проверки
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, keepalive_timeout=60, ttl_dns_cache=300),
+        auto_decompress=False,
+    )
+    gemini_service = GeminiService(session, cache=prompt_cache)
     pollinations_service = PollinationsService(session)
+    # Параллельность генераций задана на весь бот — делим её между процессами (не меньше воркера на модель)
+    generation_queue = GenerationQueue(
+        workers={model: max(1, count // settings.workers) for model, count in settings.queue_workers.items()},
+        default_workers=max(1, settings.queue_default_workers // settings.workers),
+        max_per_user=settings.queue_max_per_user,
+        max_pending=settings.queue_max_pending,
+    )
 
+    dp["http_session"] = session
     dp["gemini_service"] = gemini_service
     dp["pollinations_service"] = pollinations_service
+    dp["generation_queue"] = generation_queue
+    dp["worker_id"] = worker_id
 
-    # Middleware
+    # Middleware: ограничение частоты первым — лишние апдейты не доходят даже до проверки подписки
+    throttling = ThrottlingMiddleware(
+        rate=settings.throttle_rate,
+        burst=settings.throttle_burst,
+        global_rate=settings.throttle_global_rate / settings.workers,
+        global_burst=max(1, settings.throttle_global_burst // settings.workers),
+        max_users=settings.throttle_max_users,
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp["throttling"] = throttling
     dp.message.outer_middleware(SubscriptionMiddleware())
     dp.callback_query.outer_middleware(SubscriptionMiddleware())
 
@@ -52,14 +148,67 @@ async def main():
         generation.router,
     )
 
+    # Все исходящие сообщения — через очередь с лимитами Telegram
+    bot.session.middleware(send_scheduler)
+    generation_log.start(bot)
+
     logger.info("Бот запускается...")
     try:
-        await dp.start_polling(bot)
+        if settings.webhook_url:
+            await run_webhook(bot, dp, worker_id)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        await generation_queue.stop()
+        await generation_log.stop()
+        await send_scheduler.stop()
         await session.close()
+        await write_buffer.stop()
+        await store.close()
         await close_db()
         await bot.session.close()
 
 
+async def _migrate():
+    await init_db()
+    await close_db()
+
+
+def _run_worker(worker_id: int):
+    asyncio.run(main(worker_id))
+
+
+def run_workers():
+    """Запускает settings.workers процессов бота и ждёт их; если один упал — останавливает все."""
+    # Миграции — один раз до старта процессов, а не наперегонки в каждом
+    asyncio.run(_migrate())
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_run_worker, args=(worker_id,), name=f"worker-{worker_id}")
+        for worker_id in range(settings.workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("Запущено процессов: %d", len(processes))
+
+    def stop(*_):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()  # SIGTERM — процесс штатно завершает webhook
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    wait([process.sentinel for process in processes])
+    stop()
+    for process in processes:
+        process.join()
+    sys.exit(1 if any(process.exitcode for process in processes) else 0)
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if settings.workers > 1:
+        run_workers()
+    else:
+        asyncio.run(main())
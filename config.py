@@ -6,6 +6,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _parse_int_map(raw: str) -> dict[str, int]:
+    """Парсит строку вида "gptimage:2,flux:16" в словарь."""
+    result = {}
+    for item in raw.split(","):
+        key, _, value = item.partition(":")
+        if key.strip() and value.strip():
+            result[key.strip()] = int(value)
+    return result
+
+
 @dataclass
 class Settings:
     bot_token: str = field(default_factory=lambda: getenv("BOT_TOKEN", ""))
@@ -18,12 +28,74 @@ class Settings:
     log_chat_id: int = field(default_factory=lambda: int(getenv("LOG_CHAT_ID") or "0"))
     admin_id: int = field(default_factory=lambda: int(getenv("ADMIN_ID") or "0"))
     db_path: str = field(default_factory=lambda: getenv("DB_PATH", "bot.db"))
+    # Очередь генераций: воркеров на модель, лимит на пользователя, размер очереди модели
+    queue_workers: dict[str, int] = field(default_factory=lambda: _parse_int_map(
+        getenv("QUEUE_WORKERS", "gptimage:2,klein-large:2,klein:4,imagen-4:8,flux:16,zimage:16")
+    ))
+    queue_default_workers: int = field(default_factory=lambda: int(getenv("QUEUE_DEFAULT_WORKERS") or "4"))
+    queue_max_per_user: int = field(default_factory=lambda: int(getenv("QUEUE_MAX_PER_USER") or "2"))
+    queue_max_pending: int = field(default_factory=lambda: int(getenv("QUEUE_MAX_PENDING") or "200"))
+    # Кэш проверки подписки: TTL для подписанных / неподписанных и размер
+    subscription_cache_ttl: int = field(default_factory=lambda: int(getenv("SUBSCRIPTION_CACHE_TTL") or "600"))
+    subscription_cache_negative_ttl: int = field(
+        default_factory=lambda: int(getenv("SUBSCRIPTION_CACHE_NEGATIVE_TTL") or "30")
+    )
+    subscription_cache_size: int = field(default_factory=lambda: int(getenv("SUBSCRIPTION_CACHE_SIZE") or "100000"))
+    # Кэш готовых картинок на диске (пустой путь — кэш выключен)
+    image_cache_dir: str = field(default_factory=lambda: getenv("IMAGE_CACHE_DIR", ""))
+    image_cache_max_mb: int = field(default_factory=lambda: int(getenv("IMAGE_CACHE_MAX_MB") or "1024"))
+    # Скачивание картинок: больше image_spool_bytes — во временный файл, больше image_max_bytes — ошибка
+    image_spool_bytes: int = field(default_factory=lambda: int(getenv("IMAGE_SPOOL_BYTES") or str(512 * 1024)))
+    image_max_bytes: int = field(default_factory=lambda: int(getenv("IMAGE_MAX_BYTES") or str(20 * 1024 * 1024)))
+    # Circuit breaker моделей и общий бюджет времени на генерацию со всеми повторами
+    circuit_failure_threshold: int = field(default_factory=lambda: int(getenv("CIRCUIT_FAILURE_THRESHOLD") or "5"))
+    circuit_reset_timeout: int = field(default_factory=lambda: int(getenv("CIRCUIT_RESET_TIMEOUT") or "60"))
+    generation_deadline: int = field(default_factory=lambda: int(getenv("GENERATION_DEADLINE") or "180"))
+    # Запасные модели: при ошибке или исчерпанном лимите берётся следующая по списку
+    model_fallback_order: list[str] = field(default_factory=lambda: [
+        m.strip() for m in getenv("MODEL_FALLBACK_ORDER", "gptimage,klein-large,imagen-4,klein,zimage,flux").split(",")
+        if m.strip()
+    ])
+    fallback_max_models: int = field(default_factory=lambda: int(getenv("FALLBACK_MAX_MODELS") or "2"))
+    fallback_slow_latency: int = field(default_factory=lambda: int(getenv("FALLBACK_SLOW_LATENCY") or "60"))
+    # Webhook вместо long polling: включается, если задан WEBHOOK_URL (публичный адрес бота)
+    webhook_url: str = field(default_factory=lambda: getenv("WEBHOOK_URL", "").rstrip("/"))
+    webhook_path: str = field(default_factory=lambda: getenv("WEBHOOK_PATH", "/webhook"))
+    webhook_secret: str = field(default_factory=lambda: getenv("WEBHOOK_SECRET", ""))
+    webhook_host: str = field(default_factory=lambda: getenv("WEBHOOK_HOST", "0.0.0.0"))
+    webhook_port: int = field(default_factory=lambda: int(getenv("WEBHOOK_PORT") or "8080"))
+    # Процессов бота; больше одного — только с webhook, процессы делят порт (SO_REUSEPORT)
+    workers: int = field(default_factory=lambda: int(getenv("WORKERS") or "1"))
+    # Большая сторона фото, отправляемого модели зрения
+    vision_max_edge: int = field(default_factory=lambda: int(getenv("VISION_MAX_EDGE") or "1024"))
+    # Кэш ответов Gemini на одинаковые промты (размер 0 — кэш выключен), опционально с хранением в БД
+    prompt_cache_size: int = field(default_factory=lambda: int(getenv("PROMPT_CACHE_SIZE") or "5000"))
+    prompt_cache_ttl: int = field(default_factory=lambda: int(getenv("PROMPT_CACHE_TTL") or "86400"))
+    prompt_cache_persist: bool = field(
+        default_factory=lambda: getenv("PROMPT_CACHE_PERSIST", "").lower() in ("1", "true", "yes")
+    )
+    # Ограничение частоты апдейтов (token bucket): на пользователя и общее на процесс; rate 0 — без ограничения
+    throttle_rate: float = field(default_factory=lambda: float(getenv("THROTTLE_RATE") or "0.5"))
+    throttle_burst: int = field(default_factory=lambda: int(getenv("THROTTLE_BURST") or "5"))
+    throttle_global_rate: float = field(default_factory=lambda: float(getenv("THROTTLE_GLOBAL_RATE") or "50"))
+    throttle_global_burst: int = field(default_factory=lambda: int(getenv("THROTTLE_GLOBAL_BURST") or "100"))
+    throttle_max_users: int = field(default_factory=lambda: int(getenv("THROTTLE_MAX_USERS") or "100000"))
+    # Исходящие сообщения: общий лимит в секунду (делится между процессами), лимит на группу в минуту
+    tg_send_rate: float = field(default_factory=lambda: float(getenv("TG_SEND_RATE") or "30"))
+    tg_group_per_minute: int = field(default_factory=lambda: int(getenv("TG_GROUP_PER_MINUTE") or "20"))
+    tg_send_retries: int = field(default_factory=lambda: int(getenv("TG_SEND_RETRIES") or "3"))
+    # Сколько вариантов картинки на один промт можно выбрать в настройках (не больше 10 — размер альбома)
+    variants_max: int = field(default_factory=lambda: max(1, min(int(getenv("VARIANTS_MAX") or "4"), 10)))
 
     def __post_init__(self):
         if not self.bot_token:
             raise ValueError("BOT_TOKEN is required")
         if not self.api_token:
             raise ValueError("API_TOKEN is required")
+        if self.webhook_url and not self.webhook_secret:
+            raise ValueError("WEBHOOK_SECRET is required when WEBHOOK_URL is set")
+        if self.workers > 1 and not self.webhook_url:
+            raise ValueError("WORKERS > 1 requires webhook mode (WEBHOOK_URL)")
 
 
 settings = Settings()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db.database import MULTI_PROCESS, get_db
+from db.writer import write_buffer
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite: состояния переживают перезапуск, записи идут через write_buffer.
+
+    Недавние состояния держатся в LRU-кэше, поэтому чтение не ждёт сброса буфера.
+    С write_through каждая запись сразу сбрасывается в БД — для нескольких процессов, где кэш выключен.
+    Состояния, которые не менялись дольше ttl, считаются пустыми и периодически удаляются.
+    """
+
+    def __init__(self, ttl: float, cache_size: int, write_through: bool = False):
+        self._ttl = ttl
+        self._cache = LRUCache(cache_size, ttl)  # key -> (state, data)
+        self._write_through = write_through
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._purge_task: asyncio.Task | None = None
+
+    def start(self):
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None):
+        state = state.state if isinstance(state, State) else state
+        _, data = await self._load(key)
+        await self._save(key, state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]):
+        state, _ = await self._load(key)
+        await self._save(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(key)
+        return dict(data)
+
+    async def _load(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        db_key = self._key_builder.build(key)
+        cached = self._cache.get(db_key)
+        if cached is not None:
+            return cached
+        # В буфере может лежать более свежая запись для этого ключа
+        if write_buffer.pending:
+            await write_buffer.flush()
+        db = await get_db()
+        cursor = await db.execute(
+            "SELECT state, data FROM fsm_storage WHERE key = ? AND updated_at >= ?",
+            (db_key, time.time() - self._ttl),
+        )
+        row = await cursor.fetchone()
+        entry = (row[0], json.loads(row[1])) if row else (None, {})
+        self._cache.set(db_key, entry)
+        return entry
+
+    async def _save(self, key: StorageKey, state: str | None, data: dict[str, Any]):
+        db_key = self._key_builder.build(key)
+        self._cache.set(db_key, (state, data))
+        if state is None and not data:
+            write_buffer.add("DELETE FROM fsm_storage WHERE key = ?", (db_key,))
+        else:
+            write_buffer.add(
+                """INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at""",
+                (db_key, state, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+        if self._write_through:
+            await write_buffer.flush()
+
+    async def _purge_loop(self):
+        while True:
+            write_buffer.add("DELETE FROM fsm_storage WHERE updated_at < ?", (time.time() - self._ttl,))
+            await asyncio.sleep(PURGE_INTERVAL)
+
+
+# В нескольких процессах следующий апдейт пользователя может попасть в другой процесс —
+# состояние читается из БД и пишется в неё сразу
+fsm_storage = SQLiteStorage(
+    ttl=int(os.getenv("FSM_STATE_TTL") or "86400"),
+    cache_size=0 if MULTI_PROCESS else int(os.getenv("FSM_CACHE_SIZE") or "10000"),
+    write_through=MULTI_PROCESS,
+)
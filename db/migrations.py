@@ -0,0 +1,263 @@
+import logging
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set[str]:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in await cursor.fetchall()}
+
+
+async def _m001_initial(db: aiosqlite.Connection):
+    """Базовая схема + то, что раньше делали try/except-миграции."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            clarification_enabled INTEGER DEFAULT 1,
+            selected_model TEXT DEFAULT 'imagen-4',
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            original_prompt TEXT NOT NULL,
+            final_prompt TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS model_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            used_date TEXT NOT NULL DEFAULT (date('now')),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    if "selected_model" not in await _columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN selected_model TEXT DEFAULT 'imagen-4'")
+    await db.execute(
+        "UPDATE users SET selected_model = 'imagen-4' WHERE selected_model IN ('flux', 'flux-2-dev')"
+    )
+
+
+async def _m002_indexes(db: aiosqlite.Connection):
+    """Индексы под дневные лимиты и статистику + индексируемая дата генерации."""
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_model_usage_date_user_model "
+        "ON model_usage (used_date, user_id, model)"
+    )
+    if "created_date" not in await _columns(db, "generations"):
+        await db.execute("ALTER TABLE generations ADD COLUMN created_date TEXT")
+    await db.execute("UPDATE generations SET created_date = date(created_at) WHERE created_date IS NULL")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_generations_date_user "
+        "ON generations (created_date, user_id)"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_generations_user ON generations (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+
+
+async def rebuild_stats(db: aiosqlite.Connection):
+    """Пересчитывает таблицы stats_* по сырым users / generations / model_usage."""
+    for table in ("stats_daily", "stats_user", "stats_user_daily", "stats_model"):
+        await db.execute(f"DELETE FROM {table}")
+    await db.execute("""
+        INSERT INTO stats_daily (day, generations)
+        SELECT created_date, COUNT(*) FROM generations WHERE true GROUP BY created_date
+        ON CONFLICT(day) DO UPDATE SET generations = excluded.generations
+    """)
+    await db.execute("""
+        INSERT INTO stats_daily (day, new_users)
+        SELECT date(created_at), COUNT(*) FROM users WHERE true GROUP BY date(created_at)
+        ON CONFLICT(day) DO UPDATE SET new_users = excluded.new_users
+    """)
+    await db.execute("""
+        INSERT INTO stats_user (user_id, generations)
+        SELECT user_id, COUNT(*) FROM generations GROUP BY user_id
+    """)
+    await db.execute("""
+        INSERT INTO stats_user_daily (day, user_id, generations)
+        SELECT created_date, user_id, COUNT(*) FROM generations GROUP BY created_date, user_id
+    """)
+    await db.execute("""
+        INSERT INTO stats_model (model, usage)
+        SELECT model, COUNT(*) FROM model_usage GROUP BY model
+    """)
+
+
+async def _m003_stats_rollup(db: aiosqlite.Connection):
+    """Агрегаты для админ-аналитики, которые триггеры обновляют при каждой вставке."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            generations INTEGER NOT NULL DEFAULT 0,
+            new_users INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_user (
+            user_id INTEGER PRIMARY KEY,
+            generations INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_stats_user_generations ON stats_user (generations)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_user_daily (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            generations INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stats_user_daily_top ON stats_user_daily (day, generations)"
+    )
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_model (
+            model TEXT PRIMARY KEY,
+            usage INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # AFTER INSERT не срабатывает на ветке DO UPDATE у upsert — ensure_user
+    # увеличивает new_users только для действительно новых пользователей
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats AFTER INSERT ON users
+        BEGIN
+            INSERT INTO stats_daily (day, new_users) VALUES (date(NEW.created_at), 1)
+            ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_generations_stats AFTER INSERT ON generations
+        BEGIN
+            INSERT INTO stats_daily (day, generations)
+            VALUES (COALESCE(NEW.created_date, date(NEW.created_at)), 1)
+            ON CONFLICT(day) DO UPDATE SET generations = generations + 1;
+            INSERT INTO stats_user (user_id, generations) VALUES (NEW.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET generations = generations + 1;
+            INSERT INTO stats_user_daily (day, user_id, generations)
+            VALUES (COALESCE(NEW.created_date, date(NEW.created_at)), NEW.user_id, 1)
+            ON CONFLICT(day, user_id) DO UPDATE SET generations = generations + 1;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_model_usage_stats AFTER INSERT ON model_usage
+        BEGIN
+            INSERT INTO stats_model (model, usage) VALUES (NEW.model, 1)
+            ON CONFLICT(model) DO UPDATE SET usage = usage + 1;
+        END
+    """)
+    await rebuild_stats(db)
+
+
+async def _m004_image_file_ids(db: aiosqlite.Connection):
+    """file_id уже отправленных картинок по ключу кэша — повторы шлются без загрузки."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS image_file_ids (
+            cache_key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+
+
+async def _m005_prompt_cache(db: aiosqlite.Connection):
+    """Кэш ответов Gemini и переключатель кэша у пользователя."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            cache_key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_created ON prompt_cache(created_at)")
+    if "prompt_cache_enabled" not in await _columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN prompt_cache_enabled INTEGER DEFAULT 1")
+
+
+async def _m006_fsm_storage(db: aiosqlite.Connection):
+    """Состояния FSM — диалоги не теряются при перезапуске."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at)")
+
+
+async def _m007_usage_counters(db: aiosqlite.Connection):
+    """Дневные счётчики использования моделей — общий для процессов источник лимитов."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id, model)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT OR REPLACE INTO usage_counters (day, user_id, model, count)
+        SELECT used_date, user_id, model, COUNT(*) FROM model_usage
+        WHERE used_date IS NOT NULL
+        GROUP BY used_date, user_id, model
+    """)
+
+
+async def _m008_variants(db: aiosqlite.Connection):
+    """Сколько вариантов картинки генерировать на один промт."""
+    if "variants" not in await _columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN variants INTEGER DEFAULT 1")
+
+
+# Версия схемы = номер последней применённой миграции (PRAGMA user_version).
+# Новые миграции только дописываются в конец списка.
+MIGRATIONS: list[Migration] = [
+    _m001_initial,
+    _m002_indexes,
+    _m003_stats_rollup,
+    _m004_image_file_ids,
+    _m005_prompt_cache,
+    _m006_fsm_storage,
+    _m007_usage_counters,
+    _m008_variants,
+]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    return row[0]
+
+
+async def run_migrations(db: aiosqlite.Connection, target: int | None = None):
+    """Применяет недостающие миграции, каждую в отдельной транзакции."""
+    if target is None:
+        target = len(MIGRATIONS)
+    version = await get_schema_version(db)
+    for number in range(version + 1, target + 1):
+        migration = MIGRATIONS[number - 1]
+        logger.info("Применяю миграцию %d: %s", number, migration.__name__)
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.exception("Миграция %d не применилась", number)
+            raise
@@ -1,4 +1,13 @@
-from db.database import get_db
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from db.database import MULTI_PROCESS, get_db
+from db.migrations import rebuild_stats as _rebuild_stats
+from db.store import store
+from db.writer import write_buffer
+from utils.cache import LRUCache
 
 # Конфиг моделей: display_name, emoji, daily_limit (0 = безлимитно)
 MODELS = {
@@ -10,43 +19,101 @@ MODELS = {
     "gptimage": {"name": "GPT Image", "emoji": "🤖", "limit": 3},
 }
 
+# Кэш строк users (write-through); в нескольких процессах выключен — настройки меняются в любом из них
+_users = LRUCache(0 if MULTI_PROCESS else int(os.getenv("USER_CACHE_SIZE") or "50000"))
+_file_ids = LRUCache(int(os.getenv("FILE_ID_CACHE_SIZE") or "20000"))
+
+
+def _today() -> str:
+    """Текущая дата в UTC — то же, что date('now') в SQLite."""
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _now() -> str:
+    """Текущее время в UTC — то же, что datetime('now') в SQLite."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _update_cached_user(user_id: int, **fields):
+    user = _users.get(user_id)
+    if user is not None:
+        user.update(fields)
+
+
+def get_user_cache() -> LRUCache:
+    return _users
+
 
 # --- Пользователи ---
 
 async def ensure_user(user_id: int, username: str | None, full_name: str):
-    db = await get_db()
-    await db.execute(
+    existing = await get_user(user_id)
+    write_buffer.add(
         """INSERT INTO users (user_id, username, full_name, selected_model)
            VALUES (?, ?, ?, 'imagen-4')
            ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, full_name=excluded.full_name""",
         (user_id, username, full_name),
     )
-    await db.commit()
+    if existing:
+        _update_cached_user(user_id, username=username, full_name=full_name)
+    else:
+        # Строка ещё в буфере записи — кладём в кэш то, что получится после вставки
+        _users.set(user_id, {
+            "user_id": user_id,
+            "username": username,
+            "full_name": full_name,
+            "clarification_enabled": 1,
+            "prompt_cache_enabled": 1,
+            "variants": 1,
+            "selected_model": "imagen-4",
+            "created_at": _now(),
+        })
 
 
 async def get_user(user_id: int) -> dict | None:
+    user = _users.get(user_id)
+    if user is not None:
+        return dict(user)
     db = await get_db()
     cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
     row = await cursor.fetchone()
-    return dict(row) if row else None
+    if not row:
+        return None
+    user = dict(row)
+    _users.set(user_id, user)
+    return dict(user)
 
 
 async def set_clarification(user_id: int, enabled: bool):
-    db = await get_db()
-    await db.execute(
+    write_buffer.add(
         "UPDATE users SET clarification_enabled = ? WHERE user_id = ?",
         (int(enabled), user_id),
     )
-    await db.commit()
+    _update_cached_user(user_id, clarification_enabled=int(enabled))
+
+
+async def set_prompt_cache_enabled(user_id: int, enabled: bool):
+    write_buffer.add(
+        "UPDATE users SET prompt_cache_enabled = ? WHERE user_id = ?",
+        (int(enabled), user_id),
+    )
+    _update_cached_user(user_id, prompt_cache_enabled=int(enabled))
+
+
+async def set_variants(user_id: int, variants: int):
+    write_buffer.add(
+        "UPDATE users SET variants = ? WHERE user_id = ?",
+        (variants, user_id),
+    )
+    _update_cached_user(user_id, variants=variants)
 
 
 async def set_user_model(user_id: int, model: str):
-    db = await get_db()
-    await db.execute(
+    write_buffer.add(
         "UPDATE users SET selected_model = ? WHERE user_id = ?",
         (model, user_id),
     )
-    await db.commit()
+    _update_cached_user(user_id, selected_model=model)
 
 
 async def get_user_model(user_id: int) -> str:
@@ -56,48 +123,124 @@ async def get_user_model(user_id: int) -> str:
     return "imagen-4"
 
 
+async def get_user_variants(user_id: int) -> int:
+    user = await get_user(user_id)
+    return (user or {}).get("variants") or 1
+
+
 async def get_total_users() -> int:
     db = await get_db()
-    cursor = await db.execute("SELECT COUNT(*) FROM users")
+    cursor = await db.execute("SELECT COALESCE(SUM(new_users), 0) FROM stats_daily")
     row = await cursor.fetchone()
     return row[0]
 
 
 # --- Использование моделей ---
 
+# Лимиты считаются по общему store (usage_counters), model_usage — история для статистики
+
 async def get_model_usage_today(user_id: int, model: str) -> int:
+    usage = await store.get_usage(user_id, _today())
+    return usage.get(model, 0)
+
+
+async def get_model_usage_map(user_id: int) -> dict[str, int]:
+    """Использование всех моделей пользователем за сегодня: model -> count."""
+    usage = await store.get_usage(user_id, _today())
+    return {model: usage.get(model, 0) for model in MODELS}
+
+
+@dataclass(frozen=True)
+class UsageReservation:
+    """Занятый слот дневного лимита модели."""
+    user_id: int
+    model: str
+    day: str
+
+
+async def reserve_model_usage(user_id: int, model: str) -> UsageReservation | None:
+    """Атомарно занимает слот лимита до запроса к сервису; None — лимит на сегодня исчерпан."""
+    day = _today()
+    limit = MODELS.get(model, MODELS["flux"])["limit"]
+    if not await store.add_usage(user_id, model, day, limit):
+        return None
+    return UsageReservation(user_id, model, day)
+
+
+async def commit_model_usage(reservation: UsageReservation):
+    """Генерация состоялась: слот остаётся занятым, использование пишется в историю."""
+    write_buffer.add(
+        "INSERT INTO model_usage (user_id, model, used_date) VALUES (?, ?, ?)",
+        (reservation.user_id, reservation.model, reservation.day),
+    )
+
+
+async def release_model_usage(reservation: UsageReservation):
+    """Генерация не состоялась — слот возвращается."""
+    await store.remove_usage(reservation.user_id, reservation.model, reservation.day)
+
+
+# --- Кэш картинок ---
+
+async def get_image_file_id(cache_key: str) -> str | None:
+    file_id = _file_ids.get(cache_key)
+    if file_id is not None:
+        return file_id
     db = await get_db()
     cursor = await db.execute(
-        "SELECT COUNT(*) FROM model_usage WHERE user_id = ? AND model = ? AND used_date = date('now')",
-        (user_id, model),
+        "SELECT file_id FROM image_file_ids WHERE cache_key = ?", (cache_key,)
     )
     row = await cursor.fetchone()
+    if not row:
+        return None
+    _file_ids.set(cache_key, row[0])
     return row[0]
 
 
-async def add_model_usage(user_id: int, model: str):
+async def set_image_file_id(cache_key: str, file_id: str):
+    _file_ids.set(cache_key, file_id)
+    write_buffer.add(
+        "INSERT OR REPLACE INTO image_file_ids (cache_key, file_id) VALUES (?, ?)",
+        (cache_key, file_id),
+    )
+
+
+# --- Кэш промтов ---
+
+async def get_cached_prompt(cache_key: str, max_age: float) -> str | None:
     db = await get_db()
-    await db.execute(
-        "INSERT INTO model_usage (user_id, model) VALUES (?, ?)",
-        (user_id, model),
+    cursor = await db.execute(
+        "SELECT value FROM prompt_cache WHERE cache_key = ? AND created_at >= ?",
+        (cache_key, time.time() - max_age),
     )
-    await db.commit()
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def set_cached_prompt(cache_key: str, value: str):
+    write_buffer.add(
+        "INSERT OR REPLACE INTO prompt_cache (cache_key, value, created_at) VALUES (?, ?, ?)",
+        (cache_key, value, time.time()),
+    )
+
+
+async def purge_prompt_cache(max_age: float):
+    write_buffer.add("DELETE FROM prompt_cache WHERE created_at < ?", (time.time() - max_age,))
 
 
 # --- Генерации ---
 
 async def add_generation(user_id: int, original_prompt: str, final_prompt: str | None):
-    db = await get_db()
-    await db.execute(
-        "INSERT INTO generations (user_id, original_prompt, final_prompt) VALUES (?, ?, ?)",
-        (user_id, original_prompt, final_prompt),
+    write_buffer.add(
+        """INSERT INTO generations (user_id, original_prompt, final_prompt, created_date)
+           VALUES (?, ?, ?, ?)""",
+        (user_id, original_prompt, final_prompt, _today()),
     )
-    await db.commit()
 
 
 async def get_total_generations() -> int:
     db = await get_db()
-    cursor = await db.execute("SELECT COUNT(*) FROM generations")
+    cursor = await db.execute("SELECT COALESCE(SUM(generations), 0) FROM stats_daily")
     row = await cursor.fetchone()
     return row[0]
 
@@ -105,20 +248,19 @@ async def get_total_generations() -> int:
 async def get_today_generations() -> int:
     db = await get_db()
     cursor = await db.execute(
-        "SELECT COUNT(*) FROM generations WHERE date(created_at) = date('now')"
+        "SELECT generations FROM stats_daily WHERE day = ?", (_today(),)
     )
     row = await cursor.fetchone()
-    return row[0]
+    return row[0] if row else 0
 
 
 async def get_top_prompters(limit: int = 10) -> list[dict]:
     db = await get_db()
     cursor = await db.execute(
-        """SELECT u.user_id, u.username, u.full_name, COUNT(g.id) as gen_count
-           FROM users u
-           LEFT JOIN generations g ON u.user_id = g.user_id
-           GROUP BY u.user_id
-           ORDER BY gen_count DESC
+        """SELECT s.user_id, u.username, u.full_name, s.generations as gen_count
+           FROM stats_user s
+           LEFT JOIN users u ON u.user_id = s.user_id
+           ORDER BY s.generations DESC
            LIMIT ?""",
         (limit,),
     )
@@ -129,15 +271,13 @@ async def get_top_prompters(limit: int = 10) -> list[dict]:
 async def get_top_prompters_today(limit: int = 7) -> list[dict]:
     db = await get_db()
     cursor = await db.execute(
-        """SELECT u.user_id, u.username, u.full_name, COUNT(g.id) as gen_count
-           FROM users u
-           LEFT JOIN generations g ON u.user_id = g.user_id
-           WHERE date(g.created_at) = date('now')
-           GROUP BY u.user_id
-           HAVING gen_count > 0
-           ORDER BY gen_count DESC
+        """SELECT s.user_id, u.username, u.full_name, s.generations as gen_count
+           FROM stats_user_daily s
+           LEFT JOIN users u ON u.user_id = s.user_id
+           WHERE s.day = ?
+           ORDER BY s.generations DESC
            LIMIT ?""",
-        (limit,),
+        (_today(), limit),
     )
     rows = await cursor.fetchall()
     return [dict(r) for r in rows]
@@ -146,20 +286,16 @@ async def get_top_prompters_today(limit: int = 7) -> list[dict]:
 async def get_new_users_today() -> int:
     db = await get_db()
     cursor = await db.execute(
-        "SELECT COUNT(*) FROM users WHERE date(created_at) = date('now')"
+        "SELECT new_users FROM stats_daily WHERE day = ?", (_today(),)
     )
     row = await cursor.fetchone()
-    return row[0]
+    return row[0] if row else 0
 
 
 async def get_most_popular_model() -> tuple[str, int] | None:
     db = await get_db()
     cursor = await db.execute(
-        """SELECT model, COUNT(*) as usage_count
-           FROM model_usage
-           GROUP BY model
-           ORDER BY usage_count DESC
-           LIMIT 1"""
+        "SELECT model, usage FROM stats_model ORDER BY usage DESC LIMIT 1"
     )
     row = await cursor.fetchone()
     return (row[0], row[1]) if row else None
@@ -168,10 +304,21 @@ async def get_most_popular_model() -> tuple[str, int] | None:
 async def get_avg_prompts_per_user() -> float:
     db = await get_db()
     cursor = await db.execute(
-        """SELECT
-           CAST(COUNT(g.id) AS FLOAT) / NULLIF(COUNT(DISTINCT u.user_id), 0) as avg_prompts
-           FROM users u
-           LEFT JOIN generations g ON u.user_id = g.user_id"""
+        """SELECT CAST(SUM(generations) AS FLOAT) / NULLIF(SUM(new_users), 0)
+           FROM stats_daily"""
     )
     row = await cursor.fetchone()
     return row[0] if row and row[0] else 0.0
+
+
+async def rebuild_stats():
+    """Пересобирает агрегаты аналитики из сырых таблиц."""
+    async with write_buffer.exclusive():
+        db = await get_db()
+        await db.execute("BEGIN")
+        try:
+            await _rebuild_stats(db)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
@@ -0,0 +1,158 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+import aiosqlite
+
+from db.database import DB_PATH, BUSY_TIMEOUT_MS, MULTI_PROCESS, get_db
+from db.writer import write_buffer
+
+# Сколько последних дней MemoryStore держит в памяти: вчерашний нужен,
+# чтобы вернуть слоты резерваций, начатых до полуночи
+MEMORY_DAYS = 2
+
+
+class Store(ABC):
+    """Дневные счётчики использования моделей — источник лимитов.
+
+    Операции атомарны между всеми процессами, которые делят хранилище. Один процесс — память,
+    несколько — SQLite; хранилище вроде Redis реализует тот же интерфейс (INCR/DECR по ключу day:user:model).
+    """
+
+    @abstractmethod
+    async def get_usage(self, user_id: int, day: str) -> dict[str, int]:
+        """Счётчики пользователя за день: model -> count."""
+
+    @abstractmethod
+    async def add_usage(self, user_id: int, model: str, day: str, limit: int = 0) -> bool:
+        """Увеличивает счётчик на 1, если он меньше limit (0 — без лимита). False — лимит исчерпан."""
+
+    @abstractmethod
+    async def remove_usage(self, user_id: int, model: str, day: str):
+        """Уменьшает счётчик на 1 (не ниже нуля)."""
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class SQLiteStore(Store):
+    """Счётчики в таблице usage_counters, по строке на (день, пользователь, модель).
+
+    Отдельное соединение в autocommit: каждая операция — одна атомарная инструкция,
+    которая не смешивается с транзакциями буфера записи.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._db: aiosqlite.Connection | None = None
+
+    async def _conn(self) -> aiosqlite.Connection:
+        if self._db is None:
+            self._db = await aiosqlite.connect(self._path, isolation_level=None)
+            await self._db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        return self._db
+
+    async def get_usage(self, user_id: int, day: str) -> dict[str, int]:
+        db = await self._conn()
+        cursor = await db.execute(
+            "SELECT model, count FROM usage_counters WHERE day = ? AND user_id = ?",
+            (day, user_id),
+        )
+        return {model: count for model, count in await cursor.fetchall()}
+
+    async def add_usage(self, user_id: int, model: str, day: str, limit: int = 0) -> bool:
+        db = await self._conn()
+        cursor = await db.execute(
+            """INSERT INTO usage_counters (day, user_id, model, count) VALUES (?, ?, ?, 1)
+               ON CONFLICT(day, user_id, model) DO UPDATE SET count = count + 1
+               WHERE ? = 0 OR count < ?""",
+            (day, user_id, model, limit, limit),
+        )
+        return cursor.rowcount == 1
+
+    async def remove_usage(self, user_id: int, model: str, day: str):
+        db = await self._conn()
+        await db.execute(
+            """UPDATE usage_counters SET count = count - 1
+               WHERE day = ? AND user_id = ? AND model = ? AND count > 0""",
+            (day, user_id, model),
+        )
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+class MemoryStore(Store):
+    """Счётчики в памяти — для одного процесса: чтение и проверка лимита без запросов к БД.
+
+    День загружается из usage_counters при первом обращении, изменения уходят туда же
+    через write_buffer, так что после перезапуска счётчики восстанавливаются.
+    Проверка и увеличение счётчика идут без await между ними, поэтому атомарны в пределах процесса.
+    """
+
+    def __init__(self):
+        # day -> user_id -> model -> count
+        self._days: dict[str, dict[int, dict[str, int]]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _counters(self, day: str) -> dict[int, dict[str, int]]:
+        counters = self._days.get(day)
+        if counters is not None:
+            return counters
+        async with self._lock:
+            counters = self._days.get(day)
+            if counters is None:
+                counters = await self._load(day)
+                self._days[day] = counters
+                for old in sorted(self._days)[:-MEMORY_DAYS]:
+                    del self._days[old]
+        return counters
+
+    @staticmethod
+    async def _load(day: str) -> dict[int, dict[str, int]]:
+        # В буфере могут лежать изменения дня, вытесненного из памяти
+        if write_buffer.pending:
+            await write_buffer.flush()
+        db = await get_db()
+        cursor = await db.execute("SELECT user_id, model, count FROM usage_counters WHERE day = ?", (day,))
+        counters: dict[int, dict[str, int]] = {}
+        for user_id, model, count in await cursor.fetchall():
+            counters.setdefault(user_id, {})[model] = count
+        return counters
+
+    async def get_usage(self, user_id: int, day: str) -> dict[str, int]:
+        counters = await self._counters(day)
+        return dict(counters.get(user_id, {}))
+
+    async def add_usage(self, user_id: int, model: str, day: str, limit: int = 0) -> bool:
+        models = (await self._counters(day)).setdefault(user_id, {})
+        count = models.get(model, 0)
+        if limit and count >= limit:
+            return False
+        models[model] = count + 1
+        write_buffer.add(
+            """INSERT INTO usage_counters (day, user_id, model, count) VALUES (?, ?, ?, 1)
+               ON CONFLICT(day, user_id, model) DO UPDATE SET count = count + 1""",
+            (day, user_id, model),
+        )
+        return True
+
+    async def remove_usage(self, user_id: int, model: str, day: str):
+        models = (await self._counters(day)).get(user_id, {})
+        if models.get(model, 0) <= 0:
+            return
+        models[model] -= 1
+        write_buffer.add(
+            """UPDATE usage_counters SET count = count - 1
+               WHERE day = ? AND user_id = ? AND model = ? AND count > 0""",
+            (day, user_id, model),
+        )
+
+    async def close(self):
+        pass
+
+
+# Несколько процессов делят счётчики через SQLite, один процесс держит их в памяти
+store: Store = SQLiteStore(DB_PATH) if MULTI_PROCESS else MemoryStore()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from itertools import groupby
+
+from db.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Повтор пачки, которую не удалось записать из-за блокировки БД: пауза растёт вдвое до предела
+RETRY_DELAY_MIN = 0.5
+RETRY_DELAY_MAX = 10.0
+STOP_FLUSH_ATTEMPTS = 5
+
+
+def _is_busy(error: Exception) -> bool:
+    """БД временно заблокирована другим соединением или процессом — запрос можно повторить."""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class WriteBuffer:
+    """Копит INSERT/UPDATE и применяет их пачкой в одной транзакции."""
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._pending: list[tuple[str, tuple]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._retry_delay = 0.0
+        # Метрики
+        self.flushes = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._total_latency = 0.0
+
+    def add(self, sql: str, params: tuple = ()):
+        """Ставит запрос в буфер; порядок запросов сохраняется."""
+        self._pending.append((sql, params))
+        if len(self._pending) >= self._max_batch:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _ in range(STOP_FLUSH_ATTEMPTS):
+            await self.flush()
+            if not self._pending:
+                return
+            await asyncio.sleep(self._retry_delay)
+        logger.error("БД заблокирована, при остановке не записано запросов: %d", len(self._pending))
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """Сбрасывает буфер и не даёт ему писать, пока блок работает с общим соединением.
+
+        Для своих транзакций на соединении буфера: иначе фоновый сброс
+        попадёт внутрь чужой транзакции и закоммитит её на середине.
+        """
+        async with self._flush_lock:
+            await self._flush()
+            yield
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        db = await get_db()
+        started = time.perf_counter()
+        try:
+            # Подряд идущие одинаковые запросы — одним executemany
+            for sql, group in groupby(batch, key=lambda item: item[0]):
+                await db.executemany(sql, [params for _, params in group])
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            if _is_busy(e):
+                self._requeue(batch, e)
+                return
+            logger.error("Ошибка пакетной записи (%d запросов): %s", len(batch), e)
+            if not await self._write_one_by_one(batch):
+                return
+        self._retry_delay = 0.0
+
+        latency = time.perf_counter() - started
+        self.flushes += 1
+        self.rows += len(batch)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._total_latency += latency
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "rows": self.rows,
+            "errors": self.errors,
+            "busy": self.busy,
+            "last_ms": self.last_latency * 1000,
+            "avg_ms": self._total_latency / self.flushes * 1000 if self.flushes else 0.0,
+            "max_ms": self.max_latency * 1000,
+        }
+
+    def _requeue(self, batch: list[tuple[str, tuple]], error: Exception):
+        """Возвращает незаписанные запросы в начало буфера; фоновый сброс повторит их после паузы."""
+        self._pending[:0] = batch
+        self.busy += 1
+        self._retry_delay = min(max(self._retry_delay * 2, RETRY_DELAY_MIN), RETRY_DELAY_MAX)
+        logger.warning("БД занята (%s), %d запросов повторятся через %.1f с", error, len(batch), self._retry_delay)
+
+    async def _write_one_by_one(self, batch: list[tuple[str, tuple]]) -> bool:
+        """Повторяет пачку поштучно, чтобы один битый запрос не терял остальные.
+
+        Отбрасываются только запросы с постоянной ошибкой; на блокировке БД остаток пачки
+        возвращается в буфер (False).
+        """
+        db = await get_db()
+        for index, (sql, params) in enumerate(batch):
+            try:
+                await db.execute(sql, params)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                if _is_busy(e):
+                    self._requeue(batch[index:], e)
+                    return False
+                self.errors += 1
+                logger.error("Запрос отброшен: %s (%s)", e, sql.split()[0])
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._retry_delay:
+                await asyncio.sleep(self._retry_delay)
+            try:
+                # shield: отмена при остановке не должна оборвать запись пачки
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logger.error("Сбой фоновой записи в БД: %s", e, exc_info=True)
+
+
+write_buffer = WriteBuffer(
+    flush_interval=int(os.getenv("WRITE_FLUSH_INTERVAL_MS") or "200") / 1000,
+    max_batch=int(os.getenv("WRITE_MAX_BATCH") or "100"),
+)
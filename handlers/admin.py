@@ -8,9 +8,19 @@ from config import settings
 from db.models import (
     get_total_users, get_total_generations, get_today_generations,
     get_top_prompters, get_top_prompters_today, get_new_users_today,
-    get_most_popular_model, get_avg_prompts_per_user, MODELS,
+    get_most_popular_model, get_avg_prompts_per_user, get_user_cache,
+    rebuild_stats, MODELS,
 )
+from db.writer import write_buffer
 from keyboards.inline import admin_menu_kb
+from middlewares.throttling import ThrottlingMiddleware
+from services.image_cache import image_cache
+from utils.subscription import get_subscription_cache
+from services.circuit import CircuitBreaker
+from services.pollinations import PollinationsService
+from services.prompt_cache import prompt_cache
+from services.queue import GenerationQueue
+from services.send_scheduler import send_scheduler
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -27,12 +37,27 @@ async def cmd_admin(message: Message):
     await message.answer("Админ-панель:", reply_markup=admin_menu_kb())
 
 
+@router.message(Command("rebuild_stats"))
+async def cmd_rebuild_stats(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    wait_msg = await message.answer("⏳ Пересчитываю статистику...")
+    try:
+        await rebuild_stats()
+    except Exception as e:
+        logger.error("Ошибка пересчёта статистики: %s", e, exc_info=True)
+        await wait_msg.edit_text("😔 Не удалось пересчитать статистику.", reply_markup=admin_menu_kb())
+        return
+    await wait_msg.edit_text("✅ Статистика пересчитана.", reply_markup=admin_menu_kb())
+
+
 @router.callback_query(F.data == "admin_analytics")
 async def admin_analytics(callback: CallbackQuery):
     if not is_admin(callback.from_user.id):
         return
 
-    # Собираем статистику
+    # Собираем статистику, учитывая ещё не записанные генерации
+    await write_buffer.flush()
     total_users = await get_total_users()
     new_users_today = await get_new_users_today()
     total_gens = await get_total_generations()
@@ -80,3 +105,111 @@ async def admin_analytics(callback: CallbackQuery):
             text += f"  {i}. {name} — <code>{u['gen_count']}</code> ген.\n"
 
     await callback.message.edit_text(text, reply_markup=admin_menu_kb())
+
+
+@router.callback_query(F.data == "admin_status")
+async def admin_status(
+    callback: CallbackQuery,
+    generation_queue: GenerationQueue,
+    pollinations_service: PollinationsService,
+    throttling: ThrottlingMiddleware,
+    worker_id: int,
+):
+    if not is_admin(callback.from_user.id):
+        return
+
+    text = "🩺 <b>Состояние бота</b>\n━━━━━━━━━━━━━━━\n\n"
+    if settings.workers > 1:
+        # Метрики ниже — только процесса, который обработал нажатие
+        text += f"⚙️ Процесс <code>{worker_id + 1}</code> из <code>{settings.workers}</code>\n\n"
+    text += "📥 <b>Очередь генераций</b> (в работе / в очереди / воркеров):\n"
+    queue_stats = generation_queue.stats()
+    if not queue_stats:
+        text += "└ Пока пусто\n"
+    for model_id, (active, pending, size) in queue_stats.items():
+        model_info = MODELS.get(model_id, {"name": model_id, "emoji": "🎨"})
+        text += (
+            f"├ {model_info['emoji']} {model_info['name']}: "
+            f"<code>{active}</code> / <code>{pending}</code> / <code>{size}</code>\n"
+        )
+
+    health = pollinations_service.health()
+    if health:
+        text += "\n🔌 <b>Модели</b> (ошибки / средняя задержка):\n"
+    for model_id, breaker in health.items():
+        model_info = MODELS.get(model_id, {"name": model_id, "emoji": "🎨"})
+        if breaker.state == CircuitBreaker.OPEN:
+            state = f"🔴 отключена, проба через {breaker.retry_in():.0f} с"
+        elif breaker.state == CircuitBreaker.HALF_OPEN:
+            state = "🟡 пробный запрос"
+        else:
+            state = "🟢 работает"
+        latency = f"{breaker.latency:.1f} с" if breaker.latency is not None else "—"
+        text += (
+            f"├ {model_info['emoji']} {model_info['name']}: {state}, "
+            f"<code>{breaker.error_rate:.0%}</code> / <code>{latency}</code>\n"
+        )
+
+    user_cache = get_user_cache()
+    text += (
+        "\n🧠 <b>Кэш пользователей:</b>\n"
+        f"├ Записей: <code>{len(user_cache)}</code>\n"
+        f"└ Попаданий: <code>{user_cache.hit_rate:.0%}</code>\n"
+    )
+
+    sub_cache = get_subscription_cache()
+    text += (
+        "\n📢 <b>Кэш проверки подписки:</b>\n"
+        f"├ Записей: <code>{len(sub_cache)}</code>\n"
+        f"├ Попаданий / промахов: <code>{sub_cache.hits}</code> / <code>{sub_cache.misses}</code>\n"
+        f"└ Hit rate: <code>{sub_cache.hit_rate:.0%}</code>\n"
+    )
+
+    if image_cache:
+        images = image_cache.stats()
+        text += (
+            "\n🖼 <b>Кэш картинок:</b>\n"
+            f"├ Файлов: <code>{images['files']}</code> (<code>{images['mb']:.1f}</code> МБ)\n"
+            f"└ Попаданий с диска: <code>{images['hit_rate']:.0%}</code>\n"
+        )
+
+    if prompt_cache:
+        prompts = prompt_cache.stats()
+        text += (
+            "\n✍️ <b>Кэш промтов Gemini:</b>\n"
+            f"├ Записей в памяти: <code>{prompts['size']}</code>\n"
+            f"├ Попаданий / промахов: <code>{prompts['hits']}</code> / <code>{prompts['misses']}</code>\n"
+            f"└ Hit rate: <code>{prompts['hit_rate']:.0%}</code>\n"
+        )
+
+    sends = send_scheduler.stats()
+    text += (
+        "\n📤 <b>Отправка в Telegram:</b>\n"
+        f"├ В очереди: <code>{sends['pending']}</code> (в лог-чат: <code>{sends['pending_log']}</code>)\n"
+        f"├ Чатов на паузе: <code>{sends['paused_chats']}</code>\n"
+        f"├ Устаревших правок пропущено: <code>{sends['superseded']}</code>\n"
+        f"└ Отправлено / 429: <code>{sends['sent']}</code> / <code>{sends['retry_after']}</code>\n"
+    )
+
+    throttled = throttling.stats()
+    text += (
+        "\n🚦 <b>Ограничение частоты:</b>\n"
+        f"├ Пользователей: <code>{throttled['users']}</code>\n"
+        f"└ Отброшено апдейтов: <code>{throttled['dropped']}</code>\n"
+    )
+
+    writes = write_buffer.stats()
+    text += (
+        "\n💾 <b>Запись в БД:</b>\n"
+        f"├ В буфере: <code>{writes['pending']}</code>\n"
+        f"├ Пачек / строк: <code>{writes['flushes']}</code> / <code>{writes['rows']}</code>\n"
+        f"├ Задержка (посл. / сред. / макс.): <code>{writes['last_ms']:.1f}</code> / "
+        f"<code>{writes['avg_ms']:.1f}</code> / <code>{writes['max_ms']:.1f}</code> мс\n"
+        f"├ Повторов из-за блокировки БД: <code>{writes['busy']}</code>\n"
+        f"└ Отброшено запросов: <code>{writes['errors']}</code>\n"
+    )
+
+    try:
+        await callback.message.edit_text(text, reply_markup=admin_menu_kb())
+    except Exception:
+        await callback.answer()
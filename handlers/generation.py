@@ -1,40 +1,57 @@
 import asyncio
+import html
 import logging
+import random
+import time
+import uuid
 
 from aiogram import Router, F, Bot
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message, BufferedInputFile
+from aiogram.types import CallbackQuery, Message, FSInputFile, InputMediaPhoto
 
+from config import settings
 from db.models import (
-    get_user, add_generation, get_user_model,
-    get_model_usage_today, add_model_usage, MODELS,
+    get_user, add_generation, get_user_model, get_user_variants, get_model_usage_today,
+    reserve_model_usage, commit_model_usage, release_model_usage, UsageReservation,
+    get_image_file_id, set_image_file_id, MODELS,
 )
 from keyboards.inline import cancel_kb, clarification_kb, main_menu_kb
 from services.gemini import GeminiService
+from services.image_cache import image_cache, make_cache_key
 from services.logger import log_generation
-from services.pollinations import PollinationsService, GenerationError
+from services.pollinations import PollinationsService, GeneratedImage, GenerationError
+from services.queue import GenerationQueue, QueueFullError, UserQueueLimitError
 from states.generation import GenerationStates
+from utils.cache import LRUCache
+from utils.images import pick_photo_size, prepare_image
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-TG_RETRIES = 3
-TG_RETRY_DELAY = 2
 
+# Фоновые enhance_prompt, запущенные вместе с уточняющими вопросами: id из FSM -> задача.
+# TTL подчищает задачи пользователей, которые так и не ответили
+_speculative = LRUCache(10000, ttl=900)
+
+
+def _start_speculative(coro) -> str:
+    task = asyncio.ensure_future(coro)
+    # Результат может так и не понадобиться — помечаем исключение как обработанное
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    task_id = uuid.uuid4().hex
+    _speculative.set(task_id, task)
+    return task_id
+
+
+def _take_speculative(data: dict) -> asyncio.Task | None:
+    task_id = data.get("enhance_task")
+    return _speculative.pop(task_id) if task_id else None
 
-async def _tg_retry(coro_func, *args, **kwargs):
-    """Повторяет Telegram API вызов при сетевых ошибках."""
-    for attempt in range(1, TG_RETRIES + 1):
-        try:
-            return await coro_func(*args, **kwargs)
-        except Exception as e:
-            err_name = type(e).__name__
-            if "Network" in err_name or "Timeout" in err_name or "ClientOS" in str(e) or "reset by peer" in str(e):
-                logger.warning("Telegram API ошибка (попытка %d/%d): %s", attempt, TG_RETRIES, e)
-                if attempt < TG_RETRIES:
-                    await asyncio.sleep(TG_RETRY_DELAY)
-                    continue
-            raise
+
+async def _drop_speculative(state: FSMContext):
+    task = _take_speculative(await state.get_data())
+    if task:
+        task.cancel()
 
 
 @router.callback_query(F.data == "generate")
@@ -54,6 +71,7 @@ async def start_generation(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "cancel_generation")
 async def cancel_generation(callback: CallbackQuery, state: FSMContext):
+    await _drop_speculative(state)
     await state.clear()
     try:
         await callback.message.edit_text(
@@ -73,6 +91,7 @@ async def skip_clarification(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     data = await state.get_data()
     prompt = data.get("original_prompt", "")
@@ -81,18 +100,22 @@ async def skip_clarification(
         await callback.message.answer("Выберите действие:", reply_markup=main_menu_kb())
         return
 
+    # Промт обычно уже готов: черновик пришёл вместе с вопросами или формировался в фоне
+    draft = data.get("draft_prompt")
+    enhance = asyncio.sleep(0, draft) if draft else _take_speculative(data)
+    if enhance is None:
+        user = await get_user(callback.from_user.id)
+        enhance = asyncio.ensure_future(gemini_service.enhance_prompt(prompt, use_cache=_use_prompt_cache(user)))
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    wait_msg = await callback.message.answer("🎨 Формирую промт и генерирую...")
-    try:
-        final_prompt = await gemini_service.enhance_prompt(prompt)
-    except Exception:
+    wait_msg, final_prompt = await _answer_while(callback.message, "🎨 Формирую промт и генерирую...", enhance)
+    if isinstance(final_prompt, Exception):
         final_prompt = prompt
 
-    await _do_generation(callback.message, state, pollinations_service, prompt, final_prompt, wait_msg, source_chat=callback.message, user_id=callback.from_user.id, username=callback.from_user.username)
+    await _do_generation(callback.message, state, pollinations_service, generation_queue, prompt, final_prompt, wait_msg, source_chat=callback.message, user_id=callback.from_user.id, username=callback.from_user.username)
 
 
 @router.message(GenerationStates.waiting_for_prompt, F.photo)
@@ -101,18 +124,23 @@ async def process_photo_prompt(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     caption = message.caption or ""
     bot: Bot = message.bot  # type: ignore[assignment]
 
-    wait_msg = await message.answer("🎨 Анализирую изображение и формирую промт...")
-
-    photo = message.photo[-1]
-    file = await bot.download(photo)
-    image_bytes = file.read()
+    # Модели зрения хватает небольшого варианта фото — не качаем оригинал
+    photo = pick_photo_size(message.photo, settings.vision_max_edge)
+    wait_msg, file = await asyncio.gather(
+        message.answer("🎨 Анализирую изображение и формирую промт..."),
+        bot.download(photo),
+    )
+    image_data, mime = await prepare_image(
+        file.getbuffer(), settings.vision_max_edge, (photo.width, photo.height),
+    )
 
     try:
-        final_prompt = await gemini_service.enhance_prompt_with_image(image_bytes, caption)
+        final_prompt = await gemini_service.enhance_prompt_with_image(image_data, caption, mime)
     except Exception:
         if caption:
             final_prompt = caption
@@ -121,7 +149,7 @@ async def process_photo_prompt(
             await state.clear()
             return
 
-    await _do_generation(message, state, pollinations_service, caption or "image-based", final_prompt, wait_msg)
+    await _do_generation(message, state, pollinations_service, generation_queue, caption or "image-based", final_prompt, wait_msg)
 
 
 @router.message(GenerationStates.waiting_for_prompt)
@@ -130,21 +158,43 @@ async def process_prompt(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     prompt = message.text
     if not prompt:
         await message.answer("Пожалуйста, отправьте текстовое описание или фото.")
         return
 
-    await state.update_data(original_prompt=prompt)
-    user = await get_user(message.from_user.id)
+    _, user = await asyncio.gather(
+        state.update_data(original_prompt=prompt),
+        get_user(message.from_user.id),
+    )
     clarification_enabled = bool(user["clarification_enabled"]) if user else True
+    use_cache = _use_prompt_cache(user)
 
     if clarification_enabled:
-        wait_msg = await message.answer("🤔 Готовлю уточняющие вопросы...")
+        # Один запрос: вопросы показываются по мере генерации, черновой промт — для «Пропустить»
+        preview = _QuestionsPreview()
+        wait_msg, result = await _answer_while(
+            message, "🤔 Готовлю уточняющие вопросы...",
+            gemini_service.clarify_and_enhance(prompt, use_cache=use_cache, on_questions=preview),
+            preview,
+        )
+        draft, enhance_id = None, None
+        if isinstance(result, Exception):
+            logger.warning("Совмещённый запрос не удался (%s), запрашиваю вопросы отдельно", result)
+            # Промт для «Пропустить» формируется в фоне, пока пользователь читает вопросы
+            enhance_id = _start_speculative(gemini_service.enhance_prompt(prompt, use_cache=use_cache))
+            try:
+                questions = await gemini_service.generate_clarifying_questions(prompt, use_cache=use_cache)
+            except Exception as e:
+                questions = e
+        else:
+            questions, draft = result
         try:
-            questions = await gemini_service.generate_clarifying_questions(prompt)
-            await state.update_data(questions=questions)
+            if isinstance(questions, Exception):
+                raise questions
+            await state.update_data(questions=questions, draft_prompt=draft, enhance_task=enhance_id)
             await state.set_state(GenerationStates.waiting_for_clarification)
 
             text = (
@@ -156,19 +206,22 @@ async def process_prompt(
         except Exception as e:
             logger.error("Ошибка уточняющих вопросов: %s", e, exc_info=True)
             await wait_msg.edit_text("⚠️ Не удалось получить вопросы, формирую промт...")
+            enhance = asyncio.sleep(0, draft) if draft else _speculative.pop(enhance_id)
             try:
-                final_prompt = await gemini_service.enhance_prompt(prompt)
+                if enhance is None:
+                    enhance = gemini_service.enhance_prompt(prompt, use_cache=use_cache)
+                final_prompt = await enhance
             except Exception as e2:
                 logger.error("Ошибка enhance_prompt: %s", e2, exc_info=True)
                 final_prompt = prompt
-            await _do_generation(message, state, pollinations_service, prompt, final_prompt)
+            await _do_generation(message, state, pollinations_service, generation_queue, prompt, final_prompt, wait_msg)
     else:
-        wait_msg = await message.answer("🎨 Формирую промт и генерирую...")
-        try:
-            final_prompt = await gemini_service.enhance_prompt(prompt)
-        except Exception:
+        wait_msg, final_prompt = await _answer_while(
+            message, "🎨 Формирую промт и генерирую...", gemini_service.enhance_prompt(prompt, use_cache=use_cache),
+        )
+        if isinstance(final_prompt, Exception):
             final_prompt = prompt
-        await _do_generation(message, state, pollinations_service, prompt, final_prompt, wait_msg)
+        await _do_generation(message, state, pollinations_service, generation_queue, prompt, final_prompt, wait_msg)
 
 
 @router.message(GenerationStates.waiting_for_clarification)
@@ -177,6 +230,7 @@ async def process_clarification(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     answers = message.text
     if not answers:
@@ -185,14 +239,19 @@ async def process_clarification(
 
     data = await state.get_data()
     original_prompt = data["original_prompt"]
-
-    wait_msg = await message.answer("🎨 Формирую промт и генерирую...")
-    try:
-        final_prompt = await gemini_service.refine_prompt(original_prompt, answers)
-    except Exception:
+    # Ответы на вопросы меняют промт — заготовка для «Пропустить» не нужна
+    enhance = _take_speculative(data)
+    if enhance:
+        enhance.cancel()
+
+    wait_msg, final_prompt = await _answer_while(
+        message, "🎨 Формирую промт и генерирую...",
+        gemini_service.refine_prompt(original_prompt, answers),
+    )
+    if isinstance(final_prompt, Exception):
         final_prompt = original_prompt
 
-    await _do_generation(message, state, pollinations_service, original_prompt, final_prompt, wait_msg)
+    await _do_generation(message, state, pollinations_service, generation_queue, original_prompt, final_prompt, wait_msg)
 
 
 # Catch any photo when no state is set — treat as new generation
@@ -202,9 +261,10 @@ async def auto_generate_photo(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     await state.set_state(GenerationStates.waiting_for_prompt)
-    await process_photo_prompt(message, state, gemini_service, pollinations_service)
+    await process_photo_prompt(message, state, gemini_service, pollinations_service, generation_queue)
 
 
 # Catch any text when no state is set — treat as new generation prompt
@@ -214,15 +274,26 @@ async def auto_generate(
     state: FSMContext,
     gemini_service: GeminiService,
     pollinations_service: PollinationsService,
+    generation_queue: GenerationQueue,
 ):
     await state.set_state(GenerationStates.waiting_for_prompt)
-    await process_prompt(message, state, gemini_service, pollinations_service)
+    await process_prompt(message, state, gemini_service, pollinations_service, generation_queue)
+
+
+def _use_prompt_cache(user: dict | None) -> bool:
+    return bool(user.get("prompt_cache_enabled", 1)) if user else True
+
+
+def _model_label(model: str) -> str:
+    info = MODELS.get(model, {"name": model, "emoji": "🎨"})
+    return f"{info['emoji']} {info['name']}"
 
 
 async def _do_generation(
     message: Message,
     state: FSMContext,
     pollinations: PollinationsService,
+    queue: GenerationQueue,
     original_prompt: str,
     final_prompt: str,
     status_msg: Message | None = None,
@@ -230,7 +301,6 @@ async def _do_generation(
     user_id: int | None = None,
     username: str | None = None,
 ):
-    bot: Bot = message.bot  # type: ignore[assignment]
     target = source_chat or message
     if user_id is None:
         user_id = message.from_user.id
@@ -238,89 +308,314 @@ async def _do_generation(
         username = message.from_user.username
 
     # Get user's selected model
-    model = await get_user_model(user_id)
-    model_info = MODELS.get(model, MODELS["flux"])
+    selected = await get_user_model(user_id)
+    model = selected
+    fallback_reason = ""
+
+    # Слот лимита занимается атомарно до запроса к сервису; если модель отключена
+    # circuit breaker'ом или лимит исчерпан — сразу берём запасную
+    reservation = None
+    over_limit = False
+    if pollinations.is_available(selected):
+        reservation = await reserve_model_usage(user_id, selected)
+        over_limit = reservation is None
+    if reservation is None:
+        reservation = await _reserve_first(user_id, pollinations.fallback_models(selected))
+        if reservation:
+            model = reservation.model
+            fallback_reason = "лимит исчерпан" if over_limit else "временно недоступна"
+        elif not over_limit:
+            # Запасных нет — пробуем выбранную, даже если она отключена
+            reservation = await reserve_model_usage(user_id, selected)
+            over_limit = reservation is None
+    if reservation is None:
+        await state.clear()
+        model_info = MODELS.get(model, MODELS["flux"])
+        text = (
+            f"⚠️ Лимит модели <b>{model_info['emoji']} {model_info['name']}</b> "
+            f"исчерпан на сегодня ({model_info['limit']}/{model_info['limit']}).\n\n"
+            "Смените модель в настройках или попробуйте завтра."
+        )
+        if status_msg:
+            await status_msg.edit_text(text, reply_markup=main_menu_kb())
+        else:
+            await target.answer(text, reply_markup=main_menu_kb())
+        return
     logger.info(f"User {user_id} generating with model: {model}")
+    variants = min(await get_user_variants(user_id), settings.variants_max)
 
-    # Check daily limit
-    if model_info["limit"] > 0:
-        used = await get_model_usage_today(user_id, model)
-        if used >= model_info["limit"]:
-            await state.clear()
-            text = (
-                f"⚠️ Лимит модели <b>{model_info['emoji']} {model_info['name']}</b> "
-                f"исчерпан на сегодня ({model_info['limit']}/{model_info['limit']}).\n\n"
-                "Смените модель в настройках или попробуйте завтра."
-            )
-            if status_msg:
-                await status_msg.edit_text(text, reply_markup=main_menu_kb())
+    # Слоты освобождаются, если картинки так и не дошли до пользователя
+    reservations = [reservation]
+    committed = False
+    images = []
+    try:
+        # Та же картинка уже генерировалась: шлём по file_id или с диска.
+        # Варианты из кэша не берутся — пользователь ждёт новые картинки
+        cache_key = make_cache_key(final_prompt, model) if image_cache and variants == 1 else None
+        cached_file_id = await get_image_file_id(cache_key) if cache_key else None
+        cached_path = None
+        if cache_key and cached_file_id is None:
+            cached_path = await image_cache.get(cache_key)
+
+        if cached_file_id is None and cached_path is None:
+            generating_text = f"🎨 Генерирую ({_model_label(model)})..."
+            if status_msg is None:
+                status_msg = await target.answer(generating_text)
             else:
-                await target.answer(text, reply_markup=main_menu_kb())
-            return
+                try:
+                    await status_msg.edit_text(generating_text)
+                except Exception:
+                    pass
+
+            # Выбранная модель, а при ошибке сервиса — запасные со свободным лимитом
+            fallbacks = iter(pollinations.fallback_models(model))
+            for attempt in range(settings.fallback_max_models + 1):
+                if attempt > 0:
+                    next_reservation = await _reserve_first(user_id, fallbacks)
+                    if next_reservation is None:
+                        break
+                    await _release_all(reservations)
+                    reservations = [next_reservation]
+                    logger.warning("User %s: модель %s не ответила, пробую %s", user_id, model, next_reservation.model)
+                    try:
+                        await status_msg.edit_text(
+                            f"⚠️ {_model_label(model)} не отвечает, пробую {_model_label(next_reservation.model)}..."
+                        )
+                    except Exception:
+                        pass
+                    fallback_reason = "не ответила"
+                    model = next_reservation.model
+                # Каждый вариант занимает свой слот лимита; вариантов столько, сколько осталось слотов
+                for _ in range(variants - len(reservations)):
+                    extra = await reserve_model_usage(user_id, model)
+                    if extra is None:
+                        break
+                    reservations.append(extra)
+
+                try:
+                    # Каждый вариант — отдельная задача со своим воркером, в лимит пользователя идёт один запрос
+                    results = await queue.submit_many(
+                        model,
+                        user_id,
+                        _variant_jobs(pollinations, final_prompt, model, len(reservations)),
+                        on_position=_position_reporter(status_msg, model),
+                        return_exceptions=True,
+                    )
+                except (UserQueueLimitError, QueueFullError) as e:
+                    await state.clear()
+                    if isinstance(e, UserQueueLimitError):
+                        error_text = "⏳ У вас уже идут генерации — дождитесь их завершения."
+                    else:
+                        error_text = "😔 Сейчас слишком много запросов, попробуйте через минуту."
+                    await status_msg.edit_text(error_text, reply_markup=main_menu_kb())
+                    return
+                failure = next((r for r in results if isinstance(r, BaseException)), None)
+                if failure is not None:
+                    for result in results:
+                        if isinstance(result, GeneratedImage):
+                            result.close()
+                    raise failure
+                images = [r for r in results if not isinstance(r, GenerationError)]
+                error = next((r for r in results if isinstance(r, GenerationError)), None)
+                # Некорректный промт отклонят и другие модели
+                if images or error.error_type == "bad_prompt":
+                    break
+
+            if not images:
+                await state.clear()
+                if error.error_type == "bad_prompt":
+                    error_text = (
+                        "⚠️ Некорректный промт — сервис отклонил запрос.\n"
+                        "Попробуйте переформулировать описание."
+                    )
+                elif error.error_type == "timeout":
+                    error_text = "⏳ Сервис не ответил вовремя. Попробуйте позже."
+                else:
+                    error_text = "😔 Сервис временно недоступен, придется подождать или поменять модель🙃"
+                await status_msg.edit_text(error_text, reply_markup=main_menu_kb())
+                return
+
+            # Слоты несостоявшихся вариантов возвращаются сразу
+            await _release_all(reservations[len(images):])
+            reservations = reservations[:len(images)]
+            if cache_key:
+                cache_key = make_cache_key(final_prompt, model)
+        else:
+            logger.info("User %s: картинка из кэша (%s)", user_id, "file_id" if cached_file_id else "disk")
+        await state.clear()
 
-    if status_msg is None:
-        status_msg = await target.answer(
-            f"🎨 Генерирую ({model_info['emoji']} {model_info['name']})..."
+        caption = f"🎨 {original_prompt[:900]}"
+        if len(images) > 1:
+            album = await target.answer_media_group(media=[
+                InputMediaPhoto(media=image.input_file(f"generation_{i + 1}.png"), caption=caption if i == 0 else None)
+                for i, image in enumerate(images)
+            ])
+            file_ids = [msg.photo[-1].file_id for msg in album]
+        else:
+            if cached_file_id:
+                photo = cached_file_id
+            elif cached_path:
+                photo = FSInputFile(cached_path, filename="generation.png")
+            else:
+                photo = images[0].input_file("generation.png")
+            photo_msg = await target.answer_photo(photo=photo, caption=caption)
+            file_ids = [cached_file_id or photo_msg.photo[-1].file_id]
+        committed = True
+
+        # Картинки уже у пользователя — учёт, кэш и удаление статуса идут параллельно
+        remember = cache_key is not None and cached_file_id is None
+        remaining_text, *_ = await asyncio.gather(
+            _track_usage(reservations, selected, fallback_reason, original_prompt, final_prompt),
+            _remember_image(cache_key, file_ids[0], images[0] if images else None) if remember else asyncio.sleep(0),
+            _delete_quietly(status_msg),
         )
-    else:
-        try:
-            await status_msg.edit_text(
-                f"🎨 Генерирую ({model_info['emoji']} {model_info['name']})..."
-            )
-        except Exception:
-            pass
+    finally:
+        for image in images:
+            image.close()
+        if not committed:
+            await _release_all(reservations)
+
+    if variants > 1 and len(file_ids) < variants:
+        remaining_text = f"\nℹ️ Готово вариантов: {len(file_ids)} из {variants}.{remaining_text}"
+    await target.answer(
+        f"Напишите новый запрос или выберите действие:{remaining_text}",
+        reply_markup=main_menu_kb(),
+    )
 
-    result = await pollinations.generate_image(final_prompt, model=model)
-    await state.clear()
+    # Лог уходит в фоне по file_id — без повторной загрузки картинки
+    for file_id in file_ids:
+        log_generation(user_id, username, original_prompt, file_id, model=model)
 
-    if isinstance(result, GenerationError):
-        if result.error_type == "bad_prompt":
-            error_text = (
-                "⚠️ Некорректный промт — сервис отклонил запрос.\n"
-                "Попробуйте переформулировать описание."
-            )
-        elif result.error_type == "timeout":
-            error_text = "⏳ Сервис не ответил вовремя. Попробуйте позже."
-        else:
-            error_text = "😔 Сервис временно недоступен, придется подождать или поменять модель🙃"
-        await _tg_retry(status_msg.edit_text, error_text, reply_markup=main_menu_kb())
-        return
 
-    image_data = result
+def _variant_jobs(pollinations: PollinationsService, prompt: str, model: str, count: int) -> list:
+    """Задачи очереди на count вариантов промта с разными seed; один вариант — без seed, как раньше."""
+    if count == 1:
+        return [lambda: pollinations.generate_image(prompt, model=model)]
+    return [
+        lambda seed=seed: pollinations.generate_image(prompt, model=model, seed=seed)
+        for seed in random.sample(range(1, 2**31), count)
+    ]
 
-    # Track usage
-    await add_model_usage(user_id, model)
+
+async def _reserve_first(user_id: int, models) -> UsageReservation | None:
+    """Занимает слот в первой модели из models, у которой не исчерпан лимит."""
+    for model in models:
+        reservation = await reserve_model_usage(user_id, model)
+        if reservation:
+            return reservation
+    return None
+
+
+async def _release_all(reservations: list[UsageReservation]):
+    for reservation in reservations:
+        await release_model_usage(reservation)
+
+
+async def _track_usage(
+    reservations: list[UsageReservation],
+    selected: str,
+    fallback_reason: str,
+    original_prompt: str,
+    final_prompt: str,
+) -> str:
+    """Учитывает генерацию (по слоту на вариант) и возвращает строку с остатком лимита для меню."""
+    user_id, model = reservations[0].user_id, reservations[0].model
+    model_info = MODELS.get(model, MODELS["flux"])
+    for reservation in reservations:
+        await commit_model_usage(reservation)
     await add_generation(user_id, original_prompt, final_prompt)
 
-    # Show remaining
     remaining_text = ""
+    if model != selected:
+        remaining_text += f"\nℹ️ {_model_label(selected)} — {fallback_reason}, использована {_model_label(model)}."
     if model_info["limit"] > 0:
         used = await get_model_usage_today(user_id, model)
         remaining = model_info["limit"] - used
-        remaining_text = f"\n{model_info['emoji']} {model_info['name']} — осталось {remaining}/{model_info['limit']}"
+        remaining_text += f"\n{model_info['emoji']} {model_info['name']} — осталось {remaining}/{model_info['limit']}"
+    return remaining_text
+
 
-    photo = BufferedInputFile(image_data, filename="generation.png")
-    caption = f"🎨 {original_prompt[:900]}"
-    await _tg_retry(target.answer_photo, photo=photo, caption=caption)
+async def _remember_image(cache_key: str, file_id: str, image):
+    await set_image_file_id(cache_key, file_id)
+    if image:
+        await image_cache.put(cache_key, image)
 
+
+async def _delete_quietly(msg: Message | None):
+    if msg is None:
+        return
     try:
-        await status_msg.delete()
+        await msg.delete()
     except Exception:
         pass
 
-    await _tg_retry(
-        target.answer,
-        f"Напишите новый запрос или выберите действие:{remaining_text}",
-        reply_markup=main_menu_kb(),
-    )
 
-    # Log in background to not delay response
-    asyncio.create_task(log_generation(
-        bot,
-        user_id,
-        username,
-        original_prompt,
-        final_prompt,
-        image_data,
-        model=model,
-    ))
+async def _answer_while(message: Message, text: str, request, preview: "_QuestionsPreview | None" = None):
+    """Отправляет статусное сообщение, пока запрос request уже выполняется.
+
+    Возвращает (сообщение, результат); при ошибке запроса вместо результата — исключение.
+    preview получает отправленное сообщение, чтобы показывать в нём ответ по мере генерации.
+    """
+    task = asyncio.ensure_future(request)
+    try:
+        wait_msg = await message.answer(text)
+    except BaseException:
+        task.cancel()
+        raise
+    if preview is not None:
+        preview.msg = wait_msg
+    try:
+        return wait_msg, await task
+    except Exception as e:
+        return wait_msg, e
+    finally:
+        if preview is not None:
+            preview.close()
+
+
+class _QuestionsPreview:
+    """Показывает уточняющие вопросы в статусном сообщении, пока они генерируются.
+
+    Правка уходит в фоне: чтение потока не ждёт Telegram, а пока предыдущая правка
+    не отправлена, новые пропускаются.
+    """
+
+    INTERVAL = 1.0  # не чаще раза в секунду — лимиты Telegram на редактирование
+
+    def __init__(self):
+        self.msg: Message | None = None
+        self._shown = ""
+        self._last = 0.0
+        self._edit: asyncio.Task | None = None
+
+    async def __call__(self, questions: str):
+        questions = questions.strip()
+        now = time.monotonic()
+        if self.msg is None or not questions or questions == self._shown or now - self._last < self.INTERVAL:
+            return
+        if self._edit is not None and not self._edit.done():
+            return
+        self._shown, self._last = questions, now
+        self._edit = asyncio.create_task(self._show(questions))
+
+    def close(self):
+        """Отменяет недошедшую правку, чтобы она не перезаписала итоговый текст."""
+        if self._edit is not None:
+            self._edit.cancel()
+            self._edit = None
+
+    async def _show(self, questions: str):
+        try:
+            await self.msg.edit_text(f"🤔 <b>Уточняющие вопросы:</b>\n\n{html.escape(questions)}▌")
+        except Exception:
+            pass
+
+
+def _position_reporter(status_msg: Message, model: str):
+    """Колбэк очереди, который показывает позицию в статусном сообщении."""
+    async def on_position(position: int):
+        if position > 0:
+            await status_msg.edit_text(f"⏳ В очереди: {position} ({_model_label(model)})...")
+        else:
+            await status_msg.edit_text(f"🎨 Генерирую ({_model_label(model)})...")
+    return on_position
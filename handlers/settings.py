@@ -1,42 +1,81 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
+from config import settings
 from db.models import (
-    get_user, set_clarification, set_user_model,
-    get_user_model, get_model_usage_today, MODELS,
+    get_user, set_clarification, set_prompt_cache_enabled, set_user_model, set_variants,
+    get_user_model, get_model_usage_map, MODELS,
 )
 from keyboards.inline import settings_kb, models_kb
 
 router = Router()
 
 
+def _flags(user: dict | None) -> tuple[bool, bool, int]:
+    """(уточнение промта, кэш промтов, число вариантов) из строки пользователя."""
+    if not user:
+        return True, True, 1
+    return (
+        bool(user["clarification_enabled"]),
+        bool(user.get("prompt_cache_enabled", 1)),
+        min(user.get("variants") or 1, settings.variants_max),
+    )
+
+
 @router.callback_query(F.data == "settings")
 async def show_settings(callback: CallbackQuery):
     user = await get_user(callback.from_user.id)
-    enabled = bool(user["clarification_enabled"]) if user else True
+    enabled, cache_enabled, variants = _flags(user)
     model = await get_user_model(callback.from_user.id)
     try:
         await callback.message.edit_text(
             "⚙️ <b>Настройки</b>",
-            reply_markup=settings_kb(enabled, model),
+            reply_markup=settings_kb(enabled, model, cache_enabled, variants),
         )
     except Exception:
         await callback.message.answer(
             "⚙️ <b>Настройки</b>",
-            reply_markup=settings_kb(enabled, model),
+            reply_markup=settings_kb(enabled, model, cache_enabled, variants),
         )
 
 
 @router.callback_query(F.data == "toggle_clarification")
 async def toggle_clarification(callback: CallbackQuery):
     user = await get_user(callback.from_user.id)
-    current = bool(user["clarification_enabled"]) if user else True
+    current, cache_enabled, variants = _flags(user)
     new_value = not current
     await set_clarification(callback.from_user.id, new_value)
     model = await get_user_model(callback.from_user.id)
     await callback.message.edit_text(
         "⚙️ <b>Настройки</b>",
-        reply_markup=settings_kb(new_value, model),
+        reply_markup=settings_kb(new_value, model, cache_enabled, variants),
+    )
+
+
+@router.callback_query(F.data == "toggle_prompt_cache")
+async def toggle_prompt_cache(callback: CallbackQuery):
+    user = await get_user(callback.from_user.id)
+    enabled, current, variants = _flags(user)
+    new_value = not current
+    await set_prompt_cache_enabled(callback.from_user.id, new_value)
+    model = await get_user_model(callback.from_user.id)
+    await callback.message.edit_text(
+        "⚙️ <b>Настройки</b>",
+        reply_markup=settings_kb(enabled, model, new_value, variants),
+    )
+
+
+@router.callback_query(F.data == "cycle_variants")
+async def cycle_variants(callback: CallbackQuery):
+    user = await get_user(callback.from_user.id)
+    enabled, cache_enabled, current = _flags(user)
+    # 1 → 2 → … → VARIANTS_MAX → 1
+    new_value = current % settings.variants_max + 1
+    await set_variants(callback.from_user.id, new_value)
+    model = await get_user_model(callback.from_user.id)
+    await callback.message.edit_text(
+        "⚙️ <b>Настройки</b>",
+        reply_markup=settings_kb(enabled, model, cache_enabled, new_value),
     )
 
 
@@ -44,15 +83,8 @@ async def toggle_clarification(callback: CallbackQuery):
 async def choose_model(callback: CallbackQuery):
     user_id = callback.from_user.id
     current = await get_user_model(user_id)
-    usage_map = {}
-    for model_id in MODELS:
-        usage_map[model_id] = await get_model_usage_today(user_id, model_id)
-
-    await callback.message.edit_text(
-        "🎨 <b>Выберите модель генерации</b>\n\n"
-        "В скобках — оставшиеся генерации на сегодня.",
-        reply_markup=models_kb(current, usage_map),
-    )
+    usage_map = await get_model_usage_map(user_id)
+    await _show_models(callback, current, usage_map)
 
 
 @router.callback_query(F.data.startswith("set_model:"))
@@ -64,26 +96,24 @@ async def set_model(callback: CallbackQuery):
 
     user_id = callback.from_user.id
     info = MODELS[model_id]
+    usage_map = await get_model_usage_map(user_id)
 
     # Check if limit reached
-    if info["limit"] > 0:
-        used = await get_model_usage_today(user_id, model_id)
-        if used >= info["limit"]:
-            await callback.answer(
-                f"Лимит {info['name']} исчерпан на сегодня ({info['limit']}/{info['limit']})",
-                show_alert=True,
-            )
-            return
+    if info["limit"] > 0 and usage_map[model_id] >= info["limit"]:
+        await callback.answer(
+            f"Лимит {info['name']} исчерпан на сегодня ({info['limit']}/{info['limit']})",
+            show_alert=True,
+        )
+        return
 
     await set_user_model(user_id, model_id)
     await callback.answer(f"{info['emoji']} {info['name']} выбрана!")
 
     # Refresh the model list
-    current = model_id
-    usage_map = {}
-    for mid in MODELS:
-        usage_map[mid] = await get_model_usage_today(user_id, mid)
+    await _show_models(callback, model_id, usage_map)
+
 
+async def _show_models(callback: CallbackQuery, current: str, usage_map: dict[str, int]):
     await callback.message.edit_text(
         "🎨 <b>Выберите модель генерации</b>\n\n"
         "В скобках — оставшиеся генерации на сегодня.",
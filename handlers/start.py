@@ -1,22 +1,24 @@
+import aiohttp
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery
 
 from db.models import ensure_user, get_user
 from keyboards.inline import subscription_kb, main_menu_kb
-from utils.subscription import check_subscription, check_bot_started
+from utils.subscription import check_subscription, check_bot_started, invalidate_subscription
 
 router = Router()
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, http_session: aiohttp.ClientSession):
     user = message.from_user
     existing_user = await get_user(user.id)
     await ensure_user(user.id, user.username, user.full_name)
 
+    invalidate_subscription(user.id)
     is_subscribed = await check_subscription(message.bot, user.id)
-    is_miniapp_started = await check_bot_started(user.id)
+    is_miniapp_started = await check_bot_started(http_session, user.id)
     if not is_subscribed or not is_miniapp_started:
         await message.answer(
             "🎨 <b>Облепиха Images AI</b>\n\n"
@@ -47,9 +49,11 @@ async def cmd_start(message: Message):
 
 
 @router.callback_query(F.data == "check_subscription")
-async def check_sub_callback(callback: CallbackQuery):
+async def check_sub_callback(callback: CallbackQuery, http_session: aiohttp.ClientSession):
+    # Пользователь говорит, что подписался — перепроверяем без кэша
+    invalidate_subscription(callback.from_user.id)
     is_subscribed = await check_subscription(callback.bot, callback.from_user.id)
-    is_miniapp_started = await check_bot_started(callback.from_user.id)
+    is_miniapp_started = await check_bot_started(http_session, callback.from_user.id)
     if not is_subscribed or not is_miniapp_started:
         if not is_subscribed and not is_miniapp_started:
             msg = "❌ Вы ещё не подписались на канал и не запустили мини-приложение!"
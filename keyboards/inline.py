@@ -26,15 +26,27 @@ def main_menu_kb() -> InlineKeyboardMarkup:
     ])
 
 
-def settings_kb(clarification_enabled: bool, current_model: str) -> InlineKeyboardMarkup:
+def settings_kb(
+    clarification_enabled: bool,
+    current_model: str,
+    prompt_cache_enabled: bool = True,
+    variants: int = 1,
+) -> InlineKeyboardMarkup:
     status = "ВКЛ ✅" if clarification_enabled else "ВЫКЛ ❌"
+    cache_status = "ВКЛ ✅" if prompt_cache_enabled else "ВЫКЛ ❌"
     model_info = MODELS.get(current_model, {"name": current_model, "emoji": "🎨"})
     model_label = f"{model_info['emoji']} {model_info['name']}"
-    return InlineKeyboardMarkup(inline_keyboard=[
+    buttons = [
         [InlineKeyboardButton(text=f"Уточнение промта: {status}", callback_data="toggle_clarification")],
+        [InlineKeyboardButton(text=f"Повтор промтов из кэша: {cache_status}", callback_data="toggle_prompt_cache")],
         [InlineKeyboardButton(text=f"Модель: {model_label}", callback_data="choose_model")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_menu")],
-    ])
+    ]
+    if settings.variants_max > 1:
+        buttons.append(
+            [InlineKeyboardButton(text=f"Вариантов на промт: {variants}", callback_data="cycle_variants")]
+        )
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
 def models_kb(current_model: str, usage_map: dict[str, int]) -> InlineKeyboardMarkup:
@@ -85,5 +97,6 @@ def our_projects_kb() -> InlineKeyboardMarkup:
 def admin_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📊 Аналитика", callback_data="admin_analytics")],
+        [InlineKeyboardButton(text="🩺 Состояние", callback_data="admin_status")],
         [InlineKeyboardButton(text="◀️ В меню", callback_data="back_to_menu")],
     ])
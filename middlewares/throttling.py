@@ -0,0 +1,110 @@
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Message, CallbackQuery
+
+from config import settings
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: пополняется на rate токенов в секунду, вмещает не больше burst."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "notified")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        # Пользователю уже сказали подождать — до следующего пропущенного апдейта молчим
+        self.notified = False
+
+    def consume(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return (1 - self.tokens) / self.rate
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты апдейтов: token bucket на пользователя и общий на процесс.
+
+    Лишние апдейты отбрасываются, о паузе пользователь узнаёт один раз.
+    Вёдра пользователей лежат в LRU-кэше ограниченного размера; rate 0 выключает ограничение.
+    Один экземпляр регистрируется и на сообщения, и на callback'и — у них общее ведро.
+    """
+
+    def __init__(self, rate: float, burst: int, global_rate: float, global_burst: int, max_users: int):
+        self._rate = rate
+        self._burst = burst
+        self._buckets = LRUCache(max_users)
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id == settings.admin_id or _from_log_chat(event):
+            return await handler(event, data)
+
+        bucket = None
+        if self._rate > 0:
+            bucket = self._buckets.get(user.id)
+            if bucket is None:
+                bucket = TokenBucket(self._rate, self._burst)
+                self._buckets.set(user.id, bucket)
+            if not bucket.consume():
+                return await self._reject(event, bucket, bucket.retry_after())
+        if self._global is not None and not self._global.consume():
+            return await self._reject(event, bucket, self._global.retry_after())
+
+        if bucket is not None:
+            bucket.notified = False
+        return await handler(event, data)
+
+    def stats(self) -> dict:
+        return {"users": len(self._buckets), "dropped": self.dropped}
+
+    async def _reject(self, event: TelegramObject, bucket: TokenBucket | None, retry_after: float):
+        self.dropped += 1
+        notify = bucket is not None and not bucket.notified
+        if notify:
+            bucket.notified = True
+        text = f"⏳ Слишком много запросов — подождите {math.ceil(retry_after)} с."
+        try:
+            if isinstance(event, CallbackQuery):
+                # На callback отвечаем всегда, иначе у пользователя крутится индикатор загрузки
+                if notify:
+                    await event.answer(text, show_alert=True)
+                else:
+                    await event.answer()
+            elif notify and isinstance(event, Message):
+                await event.answer(text)
+        except TelegramAPIError as e:
+            logger.warning("Не удалось отправить уведомление об ограничении: %s", e)
+
+
+def _from_log_chat(event: TelegramObject) -> bool:
+    chat = None
+    if isinstance(event, Message):
+        chat = event.chat
+    elif isinstance(event, CallbackQuery) and event.message:
+        chat = event.message.chat
+    return bool(chat and settings.log_chat_id and chat.id == settings.log_chat_id)
@@ -0,0 +1,73 @@
+import time
+
+
+class CircuitBreaker:
+    """Здоровье модели: circuit breaker + скользящие средние ошибок и задержки."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    EWMA_ALPHA = 0.2  # вес последнего запроса в скользящих средних
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0, half_open_probes: int = 1):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0  # ошибок подряд
+        self.opened_at = 0.0
+        self._probes = 0
+        self._probe_at = 0.0
+        # Статистика для выбора моделей
+        self.error_rate = 0.0
+        self.latency: float | None = None
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос к модели."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self._reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        if self.state == self.HALF_OPEN:
+            now = time.monotonic()
+            if self._probes >= self._half_open_probes:
+                # Пробный запрос пропал без вердикта дольше reset_timeout — пускаем новый
+                if now - self._probe_at < self._reset_timeout:
+                    return False
+                self._probes = 0
+            self._probes += 1
+            self._probe_at = now
+        return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self._reset_timeout
+
+    def retry_in(self) -> float:
+        """Через сколько секунд открытый breaker пустит пробный запрос."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self, latency: float):
+        self.failures = 0
+        self.state = self.CLOSED
+        self.error_rate *= 1 - self.EWMA_ALPHA
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.EWMA_ALPHA * (latency - self.latency)
+
+    def record_failure(self):
+        self.failures += 1
+        self.error_rate += self.EWMA_ALPHA * (1 - self.error_rate)
+        if self.state == self.HALF_OPEN or self.failures >= self._failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_ignored(self):
+        """Запрос завершился без вердикта о здоровье модели (например, 400 на промт)."""
+        if self.state == self.HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
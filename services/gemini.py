@@ -1,28 +1,119 @@
-import base64
+import json
 import logging
+import re
+from typing import Awaitable, Callable
 
 import aiohttp
 
 from config import settings
+from services.prompt_cache import PromptCache, make_prompt_key
+from utils.images import to_data_url
 
 logger = logging.getLogger(__name__)
 
+OnText = Callable[[str], Awaitable[None]]
+
+
+def _partial_json_string(raw: str, field: str) -> str | None:
+    """Значение строкового поля из ещё не дописанного JSON — чтобы показывать его по мере генерации."""
+    match = re.search(rf'"{field}"\s*:\s*"', raw)
+    if not match:
+        return None
+    value = []
+    i = match.end()
+    while i < len(raw):
+        ch = raw[i]
+        if ch == '"':
+            break
+        if ch == "\\":
+            if i + 1 >= len(raw):
+                break
+            escape = raw[i + 1]
+            if escape == "u":
+                if i + 6 > len(raw):
+                    break
+                value.append(chr(int(raw[i + 2:i + 6], 16)))
+                i += 6
+                continue
+            value.append({"n": "\n", "t": "\t", "r": "", "b": "", "f": ""}.get(escape, escape))
+            i += 2
+            continue
+        value.append(ch)
+        i += 1
+    return "".join(value)
+
+
+def _parse_clarify(raw: str) -> tuple[str, str]:
+    """Разбирает JSON совмещённого запроса в (вопросы, черновой промт)."""
+    raw = raw.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    data = json.loads(raw)
+    questions, prompt = data.get("questions"), data.get("prompt")
+    if isinstance(questions, list):
+        questions = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    if not isinstance(questions, str) or not isinstance(prompt, str) or not questions.strip() or not prompt.strip():
+        raise ValueError("В ответе нет вопросов или промта")
+    return questions.strip(), prompt.strip()
+
 
 class GeminiService:
-    def __init__(self, session: aiohttp.ClientSession):
+    def __init__(self, session: aiohttp.ClientSession, cache: PromptCache | None = None):
         self._session = session
         self._model = "gemini-2.5-flash-lite"
+        self._cache = cache
+        self._url = f"{settings.api_url}/v1/chat/completions"
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {settings.api_token}",
+            # Общая сессия создана с auto_decompress=False — просим ответ без сжатия
+            "Accept-Encoding": "identity",
+        }
+        self._timeout = aiohttp.ClientTimeout(total=30)
 
-    async def generate_clarifying_questions(self, prompt: str) -> str:
+    async def generate_clarifying_questions(self, prompt: str, use_cache: bool = True) -> str:
         system = (
             "You are an assistant helping a user create a detailed image generation prompt. "
             "The user gave you their idea. Ask 3-5 short clarifying questions to better understand "
             "what they want. Write the questions in the SAME language as the user's prompt. "
             "Number the questions. Do not add any other text."
         )
-        return await self._generate(system, prompt)
+        return await self._generate_cached(system, prompt, use_cache)
+
+    async def clarify_and_enhance(
+        self,
+        prompt: str,
+        use_cache: bool = True,
+        on_questions: OnText | None = None,
+    ) -> tuple[str, str]:
+        """Один запрос вместо двух: уточняющие вопросы и черновой промт на случай «Пропустить».
+
+        on_questions получает вопросы по мере генерации (ответ идёт потоком).
+        """
+        system = (
+            "You are an assistant helping a user create a detailed image generation prompt. "
+            "The user gave you their idea. Reply with a JSON object with two string fields, in this order: "
+            '"questions" - 3-5 short clarifying questions to better understand what they want, '
+            "written in the SAME language as the user's prompt, numbered, one per line; "
+            '"prompt" - a single detailed prompt in ENGLISH for an image generation model based on the idea '
+            "as it is. The prompt should be vivid, specific, and describe the scene, style, lighting, "
+            "colors, and composition. Output ONLY the JSON object."
+        )
+
+        async def show_questions(text: str):
+            questions = _partial_json_string(text, "questions")
+            if questions:
+                await on_questions(questions)
+
+        return await self._generate_cached(
+            system, prompt, use_cache, parse=_parse_clarify, json_mode=True,
+            on_delta=show_questions if on_questions is not None else None,
+        )
 
-    async def enhance_prompt_with_image(self, image_data: bytes, prompt: str = "") -> str:
+    async def enhance_prompt_with_image(
+        self,
+        image_data: bytes | memoryview,
+        prompt: str = "",
+        mime: str = "image/jpeg",
+    ) -> str:
         system = (
             "You are an assistant that creates detailed image generation prompts. "
             "The user sent you a reference image and optionally a text description. "
@@ -31,18 +122,17 @@ class GeminiService:
             "The prompt should be vivid, specific, and describe the scene, style, lighting, "
             "colors, and composition. Output ONLY the prompt text, nothing else."
         )
-        b64 = base64.b64encode(image_data).decode()
         user_content = [
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{b64}"},
+                "image_url": {"url": to_data_url(image_data, mime)},
             },
         ]
         if prompt:
             user_content.insert(0, {"type": "text", "text": prompt})
-        return await self._generate_multimodal(system, user_content)
+        return await self._request(system, user_content)
 
-    async def enhance_prompt(self, prompt: str) -> str:
+    async def enhance_prompt(self, prompt: str, use_cache: bool = True) -> str:
         system = (
             "You are an assistant that creates detailed image generation prompts. "
             "The user gave you their idea. "
@@ -50,7 +140,7 @@ class GeminiService:
             "The prompt should be vivid, specific, and describe the scene, style, lighting, "
             "colors, and composition. Output ONLY the prompt text, nothing else."
         )
-        return await self._generate(system, prompt)
+        return await self._generate_cached(system, prompt, use_cache)
 
     async def refine_prompt(self, original_prompt: str, answers: str) -> str:
         system = (
@@ -61,60 +151,75 @@ class GeminiService:
             "colors, and composition. Output ONLY the prompt text, nothing else."
         )
         user_text = f"Original idea: {original_prompt}\n\nAnswers to questions:\n{answers}"
-        return await self._generate(system, user_text)
+        return await self._request(system, user_text)
 
-    async def _generate_multimodal(self, system: str, user_content: list) -> str:
-        url = f"{settings.api_url}/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.api_token}",
-        }
-        payload = {
-            "model": self._model,
-            "messages": [
-                {"role": "system", "content": system},
-                {"role": "user", "content": user_content},
-            ],
-            "temperature": 0.7,
-        }
+    async def _generate_cached(self, system: str, user_text: str, use_cache: bool, parse=str, **options):
+        """_request с кэшем: одинаковые промты не уходят в API повторно.
 
-        async with self._session.post(
-            url,
-            json=payload,
-            headers=headers,
-            timeout=aiohttp.ClientTimeout(total=30),
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                logger.error("Text API error %d: %s", resp.status, text)
-                raise RuntimeError(f"Text API returned {resp.status}")
-            data = await resp.json()
-            return data["choices"][0]["message"]["content"]
+        В кэш попадает только ответ, который разобрал parse.
+        """
+        if self._cache is None or not use_cache:
+            return parse(await self._request(system, user_text, **options))
+        key = make_prompt_key(self._model, system, user_text)
+        cached = await self._cache.get(key)
+        if cached is not None:
+            return parse(cached)
+        raw = await self._request(system, user_text, **options)
+        result = parse(raw)
+        await self._cache.set(key, raw)
+        return result
 
-    async def _generate(self, system: str, user_text: str) -> str:
-        url = f"{settings.api_url}/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.api_token}",
-        }
+    async def _request(
+        self,
+        system: str,
+        user_content: str | list,
+        json_mode: bool = False,
+        on_delta: OnText | None = None,
+    ) -> str:
+        """Запрос к chat completions; с on_delta ответ читается потоком (SSE)."""
         payload = {
             "model": self._model,
             "messages": [
                 {"role": "system", "content": system},
-                {"role": "user", "content": user_text},
+                {"role": "user", "content": user_content},
             ],
             "temperature": 0.7,
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        if on_delta is not None:
+            payload["stream"] = True
 
         async with self._session.post(
-            url,
+            self._url,
             json=payload,
-            headers=headers,
-            timeout=aiohttp.ClientTimeout(total=30),
+            headers=self._headers,
+            timeout=self._timeout,
         ) as resp:
             if resp.status != 200:
                 text = await resp.text()
                 logger.error("Text API error %d: %s", resp.status, text)
                 raise RuntimeError(f"Text API returned {resp.status}")
-            data = await resp.json()
-            return data["choices"][0]["message"]["content"]
+            # Сервер может проигнорировать stream и ответить целиком
+            if on_delta is None or resp.content_type == "application/json":
+                data = await resp.json()
+                return data["choices"][0]["message"]["content"]
+            return await self._read_stream(resp, on_delta)
+
+    @staticmethod
+    async def _read_stream(resp: aiohttp.ClientResponse, on_delta: OnText) -> str:
+        """Собирает ответ из SSE-событий, передавая в on_delta накопленный текст."""
+        parts = []
+        async for line in resp.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            chunk = line[5:].strip()
+            if chunk == b"[DONE]":
+                break
+            choices = json.loads(chunk).get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                parts.append(delta)
+                await on_delta("".join(parts))
+        return "".join(parts)
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+from config import settings
+from services.pollinations import GeneratedImage, PollinationsService
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(prompt: str, model: str, width: int = 1024, height: int = 1024) -> str:
+    """Ключ картинки: sha256 от нормализованного промта, модели и размера."""
+    prompt = " ".join(PollinationsService.clean_prompt(prompt).split())
+    raw = f"{model}\n{width}x{height}\n{prompt}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ImageCache:
+    """Кэш сгенерированных картинок на диске с LRU-вытеснением по суммарному размеру."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self._dir = Path(directory)
+        self._max_bytes = max_bytes
+        self._index: OrderedDict[str, int] = OrderedDict()  # key -> размер, в порядке LRU
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Восстанавливает индекс по файлам на диске (порядок — по времени доступа)."""
+        entries = await asyncio.to_thread(self._scan)
+        for key, size in entries:
+            self._index[key] = size
+            self._total += size
+        logger.info("Кэш картинок: %d файлов, %.1f МБ", len(self._index), self._total / 2**20)
+        await self._evict()
+
+    async def get(self, key: str) -> Path | None:
+        """Путь к закэшированной картинке — её можно отдать в Telegram как файл."""
+        if key not in self._index:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            await asyncio.to_thread(self._touch, path)
+        except OSError:
+            self._forget(key)
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        self.hits += 1
+        return path
+
+    async def put(self, key: str, image: GeneratedImage):
+        if key in self._index or image.size > self._max_bytes:
+            return
+        try:
+            await asyncio.to_thread(self._write, self._path(key), image)
+        except OSError as e:
+            logger.warning("Не удалось сохранить картинку в кэш: %s", e)
+            return
+        if key in self._index:  # параллельно сохранили ту же картинку
+            return
+        self._index[key] = image.size
+        self._total += image.size
+        await self._evict()
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "files": len(self._index),
+            "mb": self._total / 2**20,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _path(self, key: str) -> Path:
+        return self._dir / key[:2] / f"{key}.img"
+
+    def _forget(self, key: str):
+        self._total -= self._index.pop(key, 0)
+
+    async def _evict(self):
+        victims = []
+        while self._total > self._max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            victims.append(self._path(key))
+        if victims:
+            await asyncio.to_thread(self._unlink, victims)
+
+    def _scan(self) -> list[tuple[str, int]]:
+        if not self._dir.exists():
+            return []
+        found = []
+        for path in self._dir.glob("*/*.img"):
+            stat = path.stat()
+            found.append((stat.st_atime, path.stem, stat.st_size))
+        found.sort()
+        return [(key, size) for _, key, size in found]
+
+    @staticmethod
+    def _touch(path: Path):
+        # Фиксируем доступ, чтобы после рестарта порядок LRU сохранился
+        os.utime(path)
+
+    @staticmethod
+    def _write(path: Path, image: GeneratedImage):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Своё имя временного файла на каждую запись: параллельные put одного ключа не мешают друг другу
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+            pass
+        try:
+            image.copy_to(tmp.name)
+            os.replace(tmp.name, path)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+
+    @staticmethod
+    def _unlink(paths: list[Path]):
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# Кэш включается, если задан IMAGE_CACHE_DIR
+image_cache: ImageCache | None = (
+    ImageCache(settings.image_cache_dir, settings.image_cache_max_mb * 2**20)
+    if settings.image_cache_dir else None
+)
@@ -1,20 +1,87 @@
+import asyncio
+import html
 import logging
 
 from aiogram import Bot
-from aiogram.types import BufferedInputFile
+from aiogram.types import InputMediaPhoto
 
 from config import settings
 
 log = logging.getLogger(__name__)
 
+MEDIA_GROUP_SIZE = 10  # максимум фото в одном альбоме Telegram
 
-async def log_generation(
-    bot: Bot,
+
+class GenerationLog:
+    """Отправляет генерации в лог-чат по file_id; при нагрузке — альбомами."""
+
+    def __init__(self, max_pending: int = 1000):
+        self._queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue(max_pending)
+        self._task: asyncio.Task | None = None
+        self._bot: Bot | None = None
+
+    def start(self, bot: Bot):
+        if not settings.log_chat_id or self._task is not None:
+            return
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, file_id: str, caption: str):
+        if self._task is None:
+            return
+        try:
+            self._queue.put_nowait((file_id, caption))
+        except asyncio.QueueFull:
+            log.warning("Log queue is full, generation is not logged")
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Пока отправляли предыдущее, могли накопиться записи — шлём их одним альбомом
+            while len(batch) < MEDIA_GROUP_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._send(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    log.error("Failed to log generation: %s", e)
+                    continue
+                # Одна битая запись не должна терять весь альбом — шлём по одной
+                log.warning("Failed to log album of %d generations, sending one by one: %s", len(batch), e)
+                for item in batch:
+                    try:
+                        await self._send([item])
+                    except Exception as e:
+                        log.error("Failed to log generation: %s", e)
+
+    async def _send(self, batch: list[tuple[str, str]]):
+        if len(batch) == 1:
+            file_id, caption = batch[0]
+            await self._bot.send_photo(chat_id=settings.log_chat_id, photo=file_id, caption=caption)
+            return
+        await self._bot.send_media_group(
+            chat_id=settings.log_chat_id,
+            media=[InputMediaPhoto(media=file_id, caption=caption) for file_id, caption in batch],
+        )
+
+
+generation_log = GenerationLog()
+
+
+def log_generation(
     user_id: int,
     username: str | None,
     original_prompt: str,
-    final_prompt: str | None,
-    image_data: bytes,
+    file_id: str,
     model: str = "flux",
 ):
     if not settings.log_chat_id:
@@ -24,15 +91,7 @@ async def log_generation(
     caption = (
         f"🎨 Модель: <b>{model}</b>\n"
         f"{user_line}\n"
-        f"💬 {original_prompt[:300]}"
+        f"💬 {html.escape(original_prompt[:300])}"
     )
-
-    try:
-        photo = BufferedInputFile(image_data, filename="generation.png")
-        await bot.send_photo(
-            chat_id=settings.log_chat_id,
-            photo=photo,
-            caption=caption[:1024],
-        )
-    except Exception as e:
-        log.error("Failed to log generation: %s", e)
+    # Лимит подписи в 1024 символа считается после разбора HTML, 300 символов промта в него укладываются
+    generation_log.add(file_id, caption)
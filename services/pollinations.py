@@ -1,14 +1,24 @@
 import asyncio
 import logging
+import random
 import re
+import shutil
+import time
+from tempfile import SpooledTemporaryFile
+from typing import AsyncGenerator
 from urllib.parse import quote
 
 import aiohttp
+from aiogram import Bot
+from aiogram.types import InputFile
 
 from config import settings
+from services.circuit import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 class GenerationError:
     """Результат неудачной генерации с типом ошибки."""
@@ -16,41 +26,133 @@ class GenerationError:
         self.error_type = error_type  # "bad_prompt" | "server_error" | "timeout"
 
 
+class GeneratedImage:
+    """Скачанная картинка: до порога лежит в памяти, больше — во временном файле."""
+
+    def __init__(self, spool: SpooledTemporaryFile, size: int):
+        self._spool = spool
+        self.size = size
+
+    def input_file(self, filename: str = "generation.png") -> InputFile:
+        return _SpooledInputFile(self._spool, filename)
+
+    def copy_to(self, path):
+        """Копирует картинку в файл (блокирующий вызов — для asyncio.to_thread)."""
+        self._spool.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(self._spool, out, DOWNLOAD_CHUNK_SIZE)
+
+    def close(self):
+        self._spool.close()
+
+
+class _SpooledInputFile(InputFile):
+    """InputFile, который читает картинку кусками прямо из spool-файла."""
+
+    def __init__(self, spool: SpooledTemporaryFile, filename: str):
+        super().__init__(filename=filename)
+        self._spool = spool
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        # С начала — чтобы повторная отправка после сетевой ошибки тоже работала
+        self._spool.seek(0)
+        while chunk := self._spool.read(self.chunk_size):
+            yield chunk
+
+
 class PollinationsService:
     MAX_RETRIES = 3
-    RETRY_DELAY = 3  # секунды
+    ATTEMPT_TIMEOUT = 120  # секунды на одну попытку
+    BACKOFF_BASE = 2  # секунды, удваивается с каждой попыткой
+    BACKOFF_MAX = 20
 
     def __init__(self, session: aiohttp.ClientSession):
         self._session = session
+        self._breakers: dict[str, CircuitBreaker] = {}
 
-    async def generate_image(
-        self, prompt: str, model: str = "flux", width: int = 1024, height: int = 1024,
-    ) -> bytes | GenerationError:
-        """Отправляет GET-запрос на API для генерации изображения."""
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                failure_threshold=settings.circuit_failure_threshold,
+                reset_timeout=settings.circuit_reset_timeout,
+            )
+            self._breakers[model] = breaker
+        return breaker
+
+    def health(self) -> dict[str, CircuitBreaker]:
+        """Состояние моделей, к которым уже были запросы."""
+        return dict(self._breakers)
+
+    def is_available(self, model: str) -> bool:
+        breaker = self._breakers.get(model)
+        return breaker is None or not breaker.is_open
+
+    def fallback_models(self, model: str) -> list[str]:
+        """Запасные модели для model: порядок из MODEL_FALLBACK_ORDER без отключённых,
+        модели с частыми ошибками или медленными ответами — в конце."""
+        chain = settings.model_fallback_order
+        candidates = chain[chain.index(model) + 1:] if model in chain else chain
+        candidates = [m for m in candidates if m != model and self.is_available(m)]
+
+        def degraded(m: str) -> tuple[bool, bool]:
+            breaker = self._breakers.get(m)
+            if breaker is None:
+                return False, False
+            slow = breaker.latency is not None and breaker.latency > settings.fallback_slow_latency
+            return breaker.error_rate >= 0.5, slow
+
+        return sorted(candidates, key=degraded)
+
+    @staticmethod
+    def clean_prompt(prompt: str) -> str:
+        """Приводит промт к виду, в котором он уходит в API."""
         # Убираем markdown-заголовки типа **Prompt:**\n\n от Gemini
         prompt = re.sub(r"^\*{1,2}[^*]+\*{1,2}\s*", "", prompt)
         # Убираем переносы строк (ломают URL path) и # (ломают URL fragment)
         prompt = prompt.replace("\n", " ").replace("\r", " ").replace("#", "")
-        prompt = prompt[:1500]
+        return prompt[:1500]
+
+    async def generate_image(
+        self, prompt: str, model: str = "flux", width: int = 1024, height: int = 1024, seed: int | None = None,
+    ) -> GeneratedImage | GenerationError:
+        """Отправляет GET-запрос на API для генерации изображения; разные seed дают разные варианты."""
+        prompt = self.clean_prompt(prompt)
         encoded_prompt = quote(prompt, safe="")
         url = f"{settings.api_url}/image/{encoded_prompt}?model={model}&width={width}&height={height}"
+        if seed is not None:
+            url += f"&seed={seed}"
         headers = {"Authorization": f"Bearer {settings.api_token}"}
 
         logger.debug("URL запроса: %s", url)
+        breaker = self.breaker(model)
+        deadline = time.monotonic() + settings.generation_deadline
         last_status = None
         for attempt in range(1, self.MAX_RETRIES + 1):
+            # Модель лежит — не ждём таймаутов и не добиваем её повторами
+            if not breaker.allow():
+                logger.warning("Модель %s недоступна (circuit breaker открыт), запрос отклонён", model)
+                return GenerationError("server_error")
+
+            started = time.monotonic()
             try:
                 async with self._session.get(
                     url,
                     headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=120),
+                    timeout=aiohttp.ClientTimeout(total=min(self.ATTEMPT_TIMEOUT, deadline - started)),
                 ) as resp:
                     if resp.status == 200:
                         content_type = resp.content_type or ""
                         if "image" in content_type:
-                            return await resp.read()
+                            result = await self._download(resp, model)
+                            if isinstance(result, GenerationError):
+                                breaker.record_failure()
+                            else:
+                                breaker.record_success(time.monotonic() - started)
+                            return result
                         else:
                             logger.warning("Не изображение от сервиса: %s", content_type)
+                            breaker.record_failure()
                             return GenerationError("server_error")
 
                     last_status = resp.status
@@ -58,12 +160,17 @@ class PollinationsService:
                     body = await resp.text()
                     if resp.status == 400:
                         logger.error("Сервис вернул 400 для модели %s: %s", model, body[:2000])
+                        breaker.record_ignored()
                         return GenerationError("bad_prompt")
 
                     logger.warning(
                         "Сервис вернул %d для модели %s (попытка %d/%d): %s",
                         resp.status, model, attempt, self.MAX_RETRIES, body[:500],
                     )
+            except asyncio.CancelledError:
+                # Отмена — не вердикт о модели, но пробный запрос half-open надо вернуть
+                breaker.record_ignored()
+                raise
             except asyncio.TimeoutError:
                 logger.warning(
                     "Таймаут запроса к сервису (попытка %d/%d)", attempt, self.MAX_RETRIES,
@@ -75,10 +182,39 @@ class PollinationsService:
                 )
                 last_status = "exception"
 
+            breaker.record_failure()
             if attempt < self.MAX_RETRIES:
-                await asyncio.sleep(self.RETRY_DELAY)
+                # Экспоненциальная пауза с jitter, в пределах общего бюджета времени
+                backoff = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt)
+                delay = backoff / 2 + random.uniform(0, backoff / 2)
+                if time.monotonic() + delay >= deadline:
+                    logger.warning("Бюджет времени на генерацию моделью %s исчерпан", model)
+                    break
+                await asyncio.sleep(delay)
 
-        logger.error("Все %d попыток для модели %s исчерпаны (последний статус: %s)", self.MAX_RETRIES, model, last_status)
+        logger.error("Генерация моделью %s не удалась (попыток: %d, последний статус: %s)", model, attempt, last_status)
         if last_status == "timeout":
             return GenerationError("timeout")
         return GenerationError("server_error")
+
+    async def _download(self, resp: aiohttp.ClientResponse, model: str) -> GeneratedImage | GenerationError:
+        """Читает тело ответа кусками в spool-файл с ограничением размера."""
+        max_bytes = settings.image_max_bytes
+        if resp.content_length and resp.content_length > max_bytes:
+            logger.warning("Слишком большая картинка от модели %s: %d байт", model, resp.content_length)
+            return GenerationError("server_error")
+
+        spool = SpooledTemporaryFile(max_size=settings.image_spool_bytes)
+        size = 0
+        try:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    logger.warning("Картинка от модели %s превысила %d байт", model, max_bytes)
+                    spool.close()
+                    return GenerationError("server_error")
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        return GeneratedImage(spool, size)
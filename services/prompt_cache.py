@@ -0,0 +1,67 @@
+import hashlib
+import logging
+
+from config import settings
+from db.models import get_cached_prompt, purge_prompt_cache, set_cached_prompt
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def make_prompt_key(model: str, system: str, text: str) -> str:
+    """Ключ ответа: модель, версия системного промта (хэш его текста) и нормализованный ввод."""
+    version = hashlib.sha256(system.encode()).hexdigest()[:12]
+    text = " ".join(text.lower().split())
+    return hashlib.sha256(f"{model}\n{version}\n{text}".encode()).hexdigest()
+
+
+class PromptCache:
+    """Кэш ответов текстовой модели: LRU с TTL в памяти и, опционально, таблица prompt_cache."""
+
+    def __init__(self, maxsize: int, ttl: float, persist: bool = False):
+        self._memory = LRUCache(maxsize, ttl)
+        self._ttl = ttl
+        self._persist = persist
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Удаляет из БД устаревшие записи."""
+        if self._persist:
+            await purge_prompt_cache(self._ttl)
+
+    async def get(self, key: str) -> str | None:
+        value = self._memory.get(key)
+        if value is None and self._persist:
+            try:
+                value = await get_cached_prompt(key, self._ttl)
+            except Exception as e:
+                logger.warning("Не удалось прочитать кэш промтов: %s", e)
+            if value is not None:
+                self._memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        self._memory.set(key, value)
+        if self._persist:
+            await set_cached_prompt(key, value)
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Кэш выключается через PROMPT_CACHE_SIZE=0
+prompt_cache: PromptCache | None = (
+    PromptCache(settings.prompt_cache_size, settings.prompt_cache_ttl, settings.prompt_cache_persist)
+    if settings.prompt_cache_size else None
+)
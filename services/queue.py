@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Колбэк позиции в очереди: N > 0 — ждёт N-м, 0 — задача взята в работу
+PositionCallback = Callable[[int], Awaitable[None]]
+
+# Позиция одной задачи сообщается не чаще раза в столько секунд: каждый уход задачи
+# из очереди сдвигает всех ожидающих, и без паузы каждая такая волна — это n правок сообщений
+POSITION_REPORT_INTERVAL = 5
+
+
+class QueueFullError(Exception):
+    """Очередь модели переполнена или остановлена."""
+
+
+class UserQueueLimitError(Exception):
+    """У пользователя уже слишком много генераций в работе."""
+
+
+@dataclass(eq=False)
+class _Group:
+    """Задачи одного запроса: в лимит пользователя засчитываются как одна."""
+    user_id: int
+    remaining: int
+
+
+@dataclass(eq=False)
+class _Job:
+    group: _Group
+    func: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    on_position: PositionCallback | None = None
+    position: int = 0  # последняя сообщённая позиция
+    reported_at: float = 0.0
+
+
+class _ModelPool:
+    def __init__(self, model: str, size: int):
+        self.model = model
+        self.size = size
+        self.pending: deque[_Job] = deque()
+        self.ready = asyncio.Condition()
+        self.active = 0
+        self.workers: list[asyncio.Task] = []
+        # Отложенный пересчёт позиций для изменений, пришедших раньше интервала
+        self.report_timer: asyncio.TimerHandle | None = None
+
+
+class GenerationQueue:
+    """Очередь генераций с отдельным пулом воркеров на каждую модель."""
+
+    def __init__(
+        self,
+        workers: dict[str, int],
+        default_workers: int = 4,
+        max_per_user: int = 2,
+        max_pending: int = 200,
+    ):
+        self._workers = workers
+        self._default_workers = default_workers
+        self._max_per_user = max_per_user
+        self._max_pending = max_pending
+        self._pools: dict[str, _ModelPool] = {}
+        self._in_flight: dict[int, int] = defaultdict(int)
+        self._callbacks: set[asyncio.Task] = set()
+        self._closed = False
+
+    async def submit(
+        self,
+        model: str,
+        user_id: int,
+        func: Callable[[], Awaitable[Any]],
+        on_position: PositionCallback | None = None,
+    ) -> Any:
+        """Ставит задачу в очередь модели и ждёт её результата."""
+        results = await self.submit_many(model, user_id, [func], on_position)
+        return results[0]
+
+    async def submit_many(
+        self,
+        model: str,
+        user_id: int,
+        funcs: list[Callable[[], Awaitable[Any]]],
+        on_position: PositionCallback | None = None,
+        return_exceptions: bool = False,
+    ) -> list[Any]:
+        """Ставит в очередь модели несколько задач одного запроса и ждёт все результаты.
+
+        Каждая задача занимает свой воркер, а в лимит пользователя запрос засчитывается один раз.
+        Позиция в очереди сообщается по первой задаче. Ошибка задачи поднимается после
+        завершения остальных; с return_exceptions она возвращается на месте результата, как в gather.
+        """
+        if self._closed:
+            raise QueueFullError(model)
+        if self._in_flight[user_id] >= self._max_per_user:
+            raise UserQueueLimitError(user_id)
+        pool = self._get_pool(model)
+        if len(pool.pending) + len(funcs) > self._max_pending:
+            logger.warning("Очередь модели %s переполнена (%d)", model, len(pool.pending))
+            raise QueueFullError(model)
+
+        loop = asyncio.get_running_loop()
+        group = _Group(user_id, len(funcs))
+        jobs = [
+            _Job(group, func, loop.create_future(), on_position if index == 0 else None)
+            for index, func in enumerate(funcs)
+        ]
+        self._in_flight[user_id] += 1
+        async with pool.ready:
+            pool.pending.extend(jobs)
+            # Все воркеры заняты — сразу показываем позицию
+            if pool.active + len(pool.pending) > pool.size:
+                self._report_positions(pool)
+            pool.ready.notify(len(jobs))
+
+        try:
+            await asyncio.wait([job.future for job in jobs])
+        finally:
+            # Хендлер отменён: результаты уже не нужны, ждущие задачи убираются из очереди
+            for job in jobs:
+                job.future.cancel()
+            waiting = [job for job in jobs if job in pool.pending]
+            for job in waiting:
+                pool.pending.remove(job)
+                self._finish(job)
+            if waiting:
+                self._report_positions(pool)
+
+        results = []
+        for job in jobs:
+            error = job.future.exception()
+            if error is not None and not return_exceptions:
+                raise error
+            results.append(error if error is not None else job.future.result())
+        return results
+
+    def stats(self) -> dict[str, tuple[int, int, int]]:
+        """Состояние пулов: модель -> (в работе, в очереди, воркеров)."""
+        return {
+            model: (pool.active, len(pool.pending), pool.size)
+            for model, pool in self._pools.items()
+        }
+
+    async def stop(self):
+        self._closed = True
+        tasks = []
+        for pool in self._pools.values():
+            while pool.pending:
+                job = pool.pending.popleft()
+                if not job.future.done():
+                    job.future.set_exception(QueueFullError(pool.model))
+            if pool.report_timer is not None:
+                pool.report_timer.cancel()
+            for worker in pool.workers:
+                worker.cancel()
+            tasks.extend(pool.workers)
+        tasks.extend(self._callbacks)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _get_pool(self, model: str) -> _ModelPool:
+        pool = self._pools.get(model)
+        if pool is None:
+            size = max(1, self._workers.get(model, self._default_workers))
+            pool = _ModelPool(model, size)
+            pool.workers = [asyncio.create_task(self._worker(pool)) for _ in range(size)]
+            self._pools[model] = pool
+            logger.info("Пул генерации %s: %d воркеров", model, size)
+        return pool
+
+    async def _worker(self, pool: _ModelPool):
+        while True:
+            async with pool.ready:
+                await pool.ready.wait_for(lambda: bool(pool.pending))
+                job = pool.pending.popleft()
+                pool.active += 1
+            try:
+                if job.future.done():
+                    continue
+                if job.position > 0:
+                    self._notify(job, 0)
+                self._report_positions(pool)
+                try:
+                    result = await job.func()
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    if not job.future.done():
+                        job.future.set_result(result)
+            finally:
+                pool.active -= 1
+                self._finish(job)
+
+    def _report_positions(self, pool: _ModelPool):
+        free = max(0, pool.size - pool.active)
+        now = time.monotonic()
+        delay = None
+        for index, job in enumerate(pool.pending):
+            position = index - free + 1
+            if position <= 0 or position == job.position:
+                continue
+            remaining = job.reported_at + POSITION_REPORT_INTERVAL - now
+            if remaining <= 0:
+                self._notify(job, position)
+            else:
+                delay = remaining if delay is None else min(delay, remaining)
+        # Придержанное изменение отправляется, когда интервал истечёт — последняя позиция не теряется
+        if delay is not None and pool.report_timer is None and not self._closed:
+            pool.report_timer = asyncio.get_running_loop().call_later(delay, self._report_later, pool)
+
+    def _report_later(self, pool: _ModelPool):
+        pool.report_timer = None
+        self._report_positions(pool)
+
+    def _notify(self, job: _Job, position: int):
+        job.position = position
+        job.reported_at = time.monotonic()
+        if job.on_position is None:
+            return
+        task = asyncio.create_task(self._safe_callback(job.on_position, position))
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+    @staticmethod
+    async def _safe_callback(callback: PositionCallback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug("Не удалось обновить позицию в очереди: %s", e)
+
+    def _finish(self, job: _Job):
+        job.group.remaining -= 1
+        if job.group.remaining == 0:
+            self._release(job.group.user_id)
+
+    def _release(self, user_id: int):
+        self._in_flight[user_id] -= 1
+        if self._in_flight[user_id] <= 0:
+            del self._in_flight[user_id]
@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, EditMessageText,
+    ForwardMessage, SendDocument, SendMediaGroup, SendMessage, SendPhoto, TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые пишут в чат и попадают под лимиты Telegram
+SCHEDULED_METHODS = (
+    SendMessage, SendPhoto, SendMediaGroup, SendDocument, CopyMessage, ForwardMessage,
+    EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup,
+)
+# Правки сообщения: из нескольких ждущих правок одного сообщения отправляется только последняя
+EDIT_METHODS = (EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup)
+
+PRIORITY_USER = 0
+PRIORITY_LOG = 1
+
+NETWORK_RETRY_DELAY = 2
+
+
+class SendSchedulerStoppedError(Exception):
+    """Планировщик остановлен, сообщение не отправлено."""
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Исходящие сообщения бота через общую очередь с лимитами Telegram.
+
+    Отправки идут не чаще rate в секунду на процесс, в группу — не чаще group_per_minute в минуту.
+    На 429 чат ставится на паузу на retry_after и отправка повторяется, сетевые ошибки тоже повторяются.
+    Ответы пользователям обгоняют сообщения в лог-чат; устаревшие правки сообщения
+    (например, позиции в очереди) вытесняются более новыми и не занимают лимит.
+    """
+
+    def __init__(self, rate: float, group_per_minute: int, retries: int):
+        self._interval = 1 / rate
+        self._group_interval = 60 / group_per_minute
+        self._retries = retries
+        # (приоритет, номер, чат, future) — future завершается, когда подошла очередь отправки
+        self._heap: list[tuple[int, int, int | str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # chat_id -> когда в чат снова можно писать; только чаты на паузе
+        self._chat_ready: dict[int | str, float] = {}
+        # (метод, чат, сообщение) -> future последней ждущей правки
+        self._edits: dict[tuple, asyncio.Future] = {}
+        self._next_send = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        self.sent = 0
+        self.retry_after_hits = 0
+        self.superseded = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        chat_id = getattr(method, "chat_id", None) if isinstance(method, SCHEDULED_METHODS) else None
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = PRIORITY_LOG if chat_id == settings.log_chat_id else PRIORITY_USER
+        edit_key = None
+        if isinstance(method, EDIT_METHODS) and method.message_id is not None:
+            edit_key = (type(method), chat_id, method.message_id)
+        for attempt in range(1, self._retries + 1):
+            if not await self._acquire(chat_id, priority, edit_key):
+                # Пока правка ждала очереди, пришла более новая — эта уже не нужна
+                return True
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after_hits += 1
+                logger.warning("Telegram просит подождать %d с (чат %s, попытка %d/%d)",
+                               e.retry_after, chat_id, attempt, self._retries)
+                self._pause(chat_id, e.retry_after)
+                if attempt == self._retries:
+                    raise
+            except TelegramNetworkError as e:
+                logger.warning("Telegram API ошибка (попытка %d/%d): %s", attempt, self._retries, e)
+                if attempt == self._retries:
+                    raise
+                await asyncio.sleep(NETWORK_RETRY_DELAY)
+
+    def stats(self) -> dict:
+        waiting = [item for item in self._heap if not item[3].done()]
+        return {
+            "pending": len(waiting),
+            "pending_log": sum(1 for item in waiting if item[0] == PRIORITY_LOG),
+            "paused_chats": len(self._chat_ready),
+            "sent": self.sent,
+            "retry_after": self.retry_after_hits,
+            "superseded": self.superseded,
+        }
+
+    async def stop(self):
+        self._closed = True
+        # Ждущие очереди отправки не должны висеть вечно — завершаем их ошибкой
+        while self._heap:
+            future = heapq.heappop(self._heap)[3]
+            if not future.done():
+                future.set_exception(SendSchedulerStoppedError())
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _acquire(self, chat_id: int | str, priority: int, edit_key: tuple | None = None) -> bool:
+        """Ждёт очереди отправки; False — ожидание правки вытеснила более новая правка того же сообщения."""
+        if self._closed:
+            raise SendSchedulerStoppedError()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        if edit_key is not None:
+            previous = self._edits.get(edit_key)
+            if previous is not None and not previous.done():
+                previous.set_result(False)
+                self.superseded += 1
+            self._edits[edit_key] = future
+        heapq.heappush(self._heap, (priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        try:
+            return await future
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) is future:
+                del self._edits[edit_key]
+
+    def _pause(self, chat_id: int | str, seconds: float):
+        ready_at = time.monotonic() + seconds
+        self._chat_ready[chat_id] = max(ready_at, self._chat_ready.get(chat_id, 0))
+
+    def _pop_ready(self) -> tuple[tuple | None, float | None]:
+        """Первая по приоритету отправка в чат, который не на паузе; иначе — сколько ждать."""
+        now = time.monotonic()
+        skipped = []
+        found = None
+        wait = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            if item[3].done():
+                continue  # ожидание отменили или вытеснили
+            chat_id = item[2]
+            ready_at = self._chat_ready.get(chat_id, 0)
+            if ready_at <= now:
+                self._chat_ready.pop(chat_id, None)
+                found = item
+                break
+            skipped.append(item)
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return found, wait
+
+    async def _run(self):
+        while True:
+            delay = self._next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._wakeup.clear()
+            item, wait = self._pop_ready()
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id, future = item
+            future.set_result(True)
+            self.sent += 1
+            now = time.monotonic()
+            self._next_send = now + self._interval
+            # Отрицательные id и @username — группы и каналы
+            if not isinstance(chat_id, int) or chat_id < 0:
+                self._chat_ready[chat_id] = now + self._group_interval
+
+
+# В нескольких процессах общий лимит делится между ними
+send_scheduler = SendScheduler(
+    rate=settings.tg_send_rate / max(settings.workers, 1),
+    group_per_minute=settings.tg_group_per_minute,
+    retries=settings.tg_send_retries,
+)
@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import io
+import logging
+
+from aiogram.types import PhotoSize
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 85
+
+# Сигнатуры форматов, которые принимает модель зрения
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def pick_photo_size(sizes: list[PhotoSize], max_edge: int) -> PhotoSize:
+    """Наименьший вариант фото, у которого большая сторона не меньше max_edge (иначе — самый крупный)."""
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= max_edge:
+            return size
+    return ordered[-1]
+
+
+def detect_mime(data: bytes | memoryview) -> str:
+    head = bytes(data[:12])
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _downscale(data: bytes | memoryview, max_edge: int) -> tuple[bytes | memoryview, str]:
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_edge:
+            return data, detect_mime(data)
+        image.thumbnail((max_edge, max_edge))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=JPEG_QUALITY)
+    return out.getbuffer(), "image/jpeg"
+
+
+async def prepare_image(
+    data: bytes | memoryview,
+    max_edge: int,
+    size: tuple[int, int] | None = None,
+) -> tuple[bytes | memoryview, str]:
+    """Уменьшает картинку до max_edge по большей стороне (в потоке) и определяет её тип.
+
+    size — известные размеры картинки: если она и так не больше max_edge, декодирование пропускается.
+    """
+    if size is not None and max(size) <= max_edge:
+        return data, detect_mime(data)
+    try:
+        return await asyncio.to_thread(_downscale, data, max_edge)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning("Не удалось уменьшить картинку: %s", e)
+        return data, detect_mime(data)
+
+
+def to_data_url(data: bytes | memoryview, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
@@ -5,49 +5,73 @@ from aiogram import Bot
 from aiogram.enums import ChatMemberStatus
 
 from config import settings
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+# user_id -> подписан ли; ошибки проверки не кэшируются
+_subscription_cache = LRUCache(settings.subscription_cache_size)
+# Запуск мини-приложения необратим — кэшируем только положительные ответы, без TTL
+_bot_started_cache = LRUCache(settings.subscription_cache_size)
+
+
+def get_subscription_cache() -> LRUCache:
+    return _subscription_cache
+
+
+def invalidate_subscription(user_id: int):
+    _subscription_cache.pop(user_id)
+
 
 async def check_subscription(bot: Bot, user_id: int) -> bool:
     if not settings.required_channel:
         return True
     if user_id == settings.admin_id:
         return True
+    cached = _subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         member = await bot.get_chat_member(
             chat_id=settings.required_channel, user_id=user_id
         )
         logger.info("User %d subscription status: %s", user_id, member.status)
-        return member.status not in (
+        subscribed = member.status not in (
             ChatMemberStatus.LEFT,
             ChatMemberStatus.KICKED,
         )
     except Exception as e:
         logger.error("Subscription check failed for user %d: %s", user_id, e)
         return False
+    ttl = settings.subscription_cache_ttl if subscribed else settings.subscription_cache_negative_ttl
+    _subscription_cache.set(user_id, subscribed, ttl=ttl)
+    return subscribed
 
 
-async def check_bot_started(user_id: int) -> bool:
+async def check_bot_started(session: aiohttp.ClientSession, user_id: int) -> bool:
     if not settings.bot_check_url or not settings.bot_check_api_key:
         return True
     if user_id == settings.admin_id:
         return True
+    if _bot_started_cache.get(user_id):
+        return True
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{settings.bot_check_url}/check",
-                params={"telegram_id": user_id},
-                headers={"X-API-Key": settings.bot_check_api_key},
-                timeout=aiohttp.ClientTimeout(total=5),
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    activated = data.get("exists", False)
-                    logger.info("User %d miniapp check: %s", user_id, activated)
-                    return activated
-                logger.warning("Miniapp check returned %d for user %d", resp.status, user_id)
-                return False
+        async with session.get(
+            f"{settings.bot_check_url}/check",
+            params={"telegram_id": user_id},
+            # Общая сессия создана с auto_decompress=False — просим ответ без сжатия
+            headers={"X-API-Key": settings.bot_check_api_key, "Accept-Encoding": "identity"},
+            timeout=aiohttp.ClientTimeout(total=5),
+        ) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                activated = data.get("exists", False)
+                logger.info("User %d miniapp check: %s", user_id, activated)
+                if activated:
+                    _bot_started_cache.set(user_id, True)
+                return activated
+            logger.warning("Miniapp check returned %d for user %d", resp.status, user_id)
+            return False
     except Exception as e:
         logger.error("Miniapp check failed for user %d: %s", user_id, e)
         return True